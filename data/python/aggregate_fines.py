@@ -1,5 +1,15 @@
 import pandas as pd
+import numpy as np
 import datetime as dt
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import fines_cache
+from money import amount_columns, fine_agg_amount_columns, to_cents, to_dollars
+from schema import read_fines_csv, concat_fines
+from dedup import drop_duplicate_fines
+from plate_keys import plate_key_ids
 
 # *********************
 # constants
@@ -7,6 +17,24 @@ import datetime as dt
 
 current_date = pd.to_datetime(dt.datetime.now().date())
 judgement_date_diff_min = 75 # days
+years = range(2023, 2026)
+backend = 'pandas' # or 'duckdb', 'polars'
+n_workers = 1 # > 1 reads and processes each year in its own process
+n_shards = 1 # > 1 hash-partitions plates across processes for crossing detection and aggregation
+chunked = False # streams fines in chunks instead of loading every year into memory
+memory_budget_mb = 1024 # memory budget for the chunked mode
+use_cache = True # reuses processed years whose source file and parameters are unchanged
+incremental = False # applies only the new or changed summonses in delta_path to the persisted per-plate state
+delta_path = '../processed/school_zone_fines_delta.csv'
+verify_incremental = False # diffs the incremental result against a full recompute
+
+plate_key = ['plate', 'state', 'license_type']
+
+# columns needed downstream of process_fines
+agg_columns = [
+    'plate', 'state', 'license_type', 'summons_number', 'issue_date',
+    'total_fine', 'payment_amount', 'amount_due', 'in_judgement'
+]
 
 # *********************
 # functions
@@ -19,6 +47,10 @@ def process_fines(fines):
         errors='coerce'
     )
 
+    print("Converting amounts to cents...")
+    for column in amount_columns:
+        fines[column] = to_cents(fines[column])
+
     print("Calculating total fines...")
     fines['total_fine'] = (
         fines['fine_amount'] + 
@@ -28,7 +60,17 @@ def process_fines(fines):
     )
 
     print("Calculating judgement status...")
-    fines['in_judgement'] = (
+    fines['in_judgement'] = judgement_status(fines)
+
+    print("Removing duplicates...")
+    # Drop duplicates treating NaN values as equal
+    fines = drop_duplicate_fines(fines)
+
+    return fines
+
+
+def judgement_status(fines):
+    return (
         # fines have been issued for more than 75 days
         (
             (current_date - fines['issue_date']).dt.days > judgement_date_diff_min
@@ -39,12 +81,13 @@ def process_fines(fines):
         )
     )
 
-    print("Removing duplicates...")
-    # Drop duplicates treating NaN values as equal
-    fines = fines.drop_duplicates()
-
-    return fines
+def violation_aggregation(fines):
+    # grouped nunique is one of the slowest aggregations, and once duplicates are dropped
+    # there is usually one row per summons, in which case a plain count is the same number
+    if fines['summons_number'].is_unique:
+        return 'count'
 
+    return 'nunique'
 
 def aggregate_fines(fines):
 
@@ -52,24 +95,26 @@ def aggregate_fines(fines):
        fines['issue_date'] > fines['tow_eligible_date']
     )
 
+    violations = violation_aggregation(fines)
+
     # Calculate total fines
-    fine_agg = fines.groupby(['plate', 'state', 'license_type', 'tow_eligible_date'], dropna=False).agg(
+    fine_agg = fines.groupby(['plate', 'state', 'license_type', 'tow_eligible_date'], dropna=False, observed=True).agg(
         total_fines = ('total_fine', 'sum'), 
         amount_paid = ('payment_amount', 'sum'), 
         amount_due = ('amount_due', 'sum'), 
-        violations = ('summons_number', 'nunique')
+        violations = ('summons_number', violations)
     ).reset_index()
 
     # calculate fines post tow eligible
-    fines_post_tow_eligible = fines[fines['post_tow_eligible'] == True].groupby(['plate', 'state', 'license_type']).agg(
+    fines_post_tow_eligible = fines[fines['post_tow_eligible'] == True].groupby(['plate', 'state', 'license_type'], observed=True).agg(
         total_fines_post_tow_eligible = ('total_fine', 'sum'), 
         amount_paid_post_tow_eligible = ('payment_amount', 'sum'), 
         amount_due_post_tow_eligible = ('amount_due', 'sum'), 
-        violations_post_tow_eligible = ('summons_number', 'nunique')
+        violations_post_tow_eligible = ('summons_number', violations)
     ).reset_index()
 
     # Calculate fines in judgement (only where in_judgement is True)
-    judgement_fines = fines[fines['in_judgement'] == True].groupby(['plate', 'state', 'license_type']).agg(
+    judgement_fines = fines[fines['in_judgement'] == True].groupby(['plate', 'state', 'license_type'], observed=True).agg(
         fines_in_judgement = ('amount_due', 'sum')
     ).reset_index()
 
@@ -84,16 +129,18 @@ def aggregate_fines(fines):
     return fine_agg
 
 def get_threshold_crossing_dates(fines, threshold=350):
+    # amounts are in cents, the threshold is in dollars
+    threshold_cents = threshold * 100
     # Only consider fines in judgement
     fines_in_judgement = fines[fines['in_judgement']].copy()
     # Sort by plate and issue_date
     fines_in_judgement = fines_in_judgement.sort_values(['plate', 'state', 'license_type', 'issue_date'])
     # Calculate cumulative sum of amount_due for each plate
-    fines_in_judgement['cumulative_due'] = fines_in_judgement.groupby(['plate', 'state', 'license_type'])['amount_due'].cumsum()
+    fines_in_judgement['cumulative_due'] = fines_in_judgement.groupby(['plate', 'state', 'license_type'], observed=True)['amount_due'].cumsum()
     # Find the first fine where cumulative_due exceeds the threshold
-    crossing = fines_in_judgement[fines_in_judgement['cumulative_due'] > threshold]
+    crossing = fines_in_judgement[fines_in_judgement['cumulative_due'] > threshold_cents]
     # Keep only the first crossing per plate
-    crossing = crossing.groupby(['plate', 'state', 'license_type']).first().reset_index()
+    crossing = crossing.groupby(['plate', 'state', 'license_type'], observed=True).first().reset_index()
     
     # now that the tow_eligible_date is really the issue date, we need to add 75 days to it
     crossing['tow_eligible_date'] = crossing['issue_date'] + pd.Timedelta(days=judgement_date_diff_min)
@@ -104,35 +151,181 @@ def get_threshold_crossing_dates(fines, threshold=350):
 
     return crossing
 
-# *********************
-# data read in 
-# *********************
-
-fines = pd.DataFrame()
-for year in range(2023, 2026):
+def read_year(year, cache=None):
     print(f'year: {year}')
-    yearly_fines = pd.read_csv(f'../processed/school_zone_fines_{year}.csv')
+    path = f'../processed/school_zone_fines_{year}.csv'
+    cache = use_cache if cache is None else cache
+
+    if cache:
+        key = fines_cache.cache_key(path, {
+            'current_date': current_date,
+            'judgement_date_diff_min': judgement_date_diff_min,
+            'columns': agg_columns
+        })
+        cached_fines = fines_cache.load(key)
+        if cached_fines is not None:
+            print(f'Loaded {year} from cache...')
+            return cached_fines
+
+    yearly_fines = read_fines_csv(path, 'aggregation')
     yearly_fines = process_fines(yearly_fines)
-    fines = pd.concat([fines, yearly_fines])
 
+    # only ship back the columns we aggregate on, which keeps 
+    # the frames pickled between processes small
+    yearly_fines = yearly_fines[agg_columns].reset_index(drop=True)
 
-# *********************
-# find threshold crossing dates
-# *********************
+    if cache:
+        fines_cache.store(key, yearly_fines)
 
-crossing_dates = get_threshold_crossing_dates(fines)
+    return yearly_fines
 
-fines = fines.merge(crossing_dates[['plate', 'state', 'license_type', 'tow_eligible_date', 'crossing_date', 'cumulative_due']], on=['plate', 'state', 'license_type'], how='left')
+def read_fines(years, n_workers=1, cache=None):
+    # passed to the workers rather than read from the module, which they may import afresh
+    read = partial(read_year, cache=cache)
 
-# *********************
-# aggregate
-# *********************
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(years))) as executor:
+            yearly_fines = list(executor.map(read, years))
+    else:
+        yearly_fines = [read(year) for year in years]
 
-fine_agg = aggregate_fines(fines)
+    # concatenate once, rather than copying prior years on every iteration
+    return concat_fines(yearly_fines)
 
-# *********************
-# save output
-# *********************
+def broadcast_tow_eligible_dates(fines, crossing_dates):
+    # look up each fine's plate in the crossing table, which only adds the one column 
+    # aggregate_fines needs rather than merging a copy of the full fines table
+    crossing_index = pd.MultiIndex.from_frame(crossing_dates[plate_key])
+    position = crossing_index.get_indexer(pd.MultiIndex.from_frame(fines[plate_key]))
+
+    # plates that never cross aren't found (-1), and pick up the trailing NaT
+    tow_eligible_dates = np.append(crossing_dates['tow_eligible_date'].to_numpy(), np.datetime64('NaT'))
+    fines['tow_eligible_date'] = tow_eligible_dates[position]
+
+def aggregate_plates(fines):
+    crossing_dates = get_threshold_crossing_dates(fines)
+
+    broadcast_tow_eligible_dates(fines, crossing_dates)
+
+    return aggregate_fines(fines)
+
+def partition_fines(fines, n_shards):
+    # hash the plate key so every fine for a plate lands in the same shard
+    plate_hash = pd.util.hash_pandas_object(fines[plate_key], index=False).to_numpy()
+    shard_ids = plate_hash % n_shards
+
+    shards = [fines[shard_ids == shard] for shard in range(n_shards)]
+
+    return [shard for shard in shards if not shard.empty]
+
+def sort_fine_agg(fine_agg):
+    # same ordering and index as a single groupby over all plates
+    fine_agg = fine_agg.sort_values(plate_key + ['tow_eligible_date'], na_position='last')
+
+    return fine_agg.reset_index(drop=True).reset_index()
+
+def aggregate_fines_partitioned(fines, n_shards):
+    # crossing detection and aggregation are both per plate, 
+    # so each shard can be processed independently
+    shards = partition_fines(fines, n_shards)
+
+    # more shards than cores only adds processes competing for the same cores
+    with ProcessPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1)) as executor:
+        shard_aggs = list(executor.map(aggregate_plates, shards))
+
+    return sort_fine_agg(pd.concat(shard_aggs).drop(columns='index'))
+
+if __name__ == '__main__':
+
+    if backend == 'duckdb':
+
+        # *********************
+        # read, find threshold crossing dates and aggregate in duckdb
+        # *********************
+
+        import duckdb
+        from aggregate_fines_duckdb import aggregate_fines_duckdb, get_rolling_violation_counts
+
+        # the rolling counts reuse the fines table the aggregation leaves on the connection
+        con = duckdb.connect()
+        fine_agg = aggregate_fines_duckdb(years, con=con)
+        rolling_violations = get_rolling_violation_counts(con)
+
+    elif backend == 'polars':
+
+        # *********************
+        # scan, find threshold crossing dates and aggregate in polars
+        # *********************
+
+        from aggregate_fines_polars import aggregate_fines_polars, get_rolling_violation_counts
+
+        fine_agg = aggregate_fines_polars(years)
+        rolling_violations = get_rolling_violation_counts(years)
+
+    elif incremental:
+
+        # *********************
+        # update the persisted per-plate state with new or changed fines
+        # *********************
+
+        from aggregate_fines_incremental import aggregate_fines_incremental
+        from rolling_violations import get_rolling_violation_counts
+
+        fines, fine_agg = aggregate_fines_incremental(years, delta_path, verify=verify_incremental)
+
+        print("Counting rolling violations...")
+        rolling_violations = get_rolling_violation_counts(fines)
+
+    elif chunked:
+
+        # *********************
+        # stream, find threshold crossing dates and aggregate
+        # *********************
+
+        from aggregate_fines_chunked import aggregate_fines_chunked
+
+        fine_agg, rolling_violations = aggregate_fines_chunked(years, memory_budget_mb=memory_budget_mb)
+
+    else:
+
+        # *********************
+        # data read in 
+        # *********************
+
+        from rolling_violations import get_rolling_violation_counts
+
+        fines = read_fines(years, n_workers=n_workers)
+
+        # *********************
+        # find threshold crossing dates and aggregate
+        # *********************
+
+        if n_shards > 1:
+            fine_agg = aggregate_fines_partitioned(fines, n_shards)
+        else:
+            fine_agg = aggregate_plates(fines)
+
+        print("Counting rolling violations...")
+        rolling_violations = get_rolling_violation_counts(fines)
+
+    # *********************
+    # rolling violation counts
+    # *********************
+
+    # every backend counts them its own way, without holding more fines than it already does
+    from rolling_violations import add_rolling_violations, violation_threshold, window_months
+
+    fine_agg = add_rolling_violations(fine_agg, rolling_violations)
+
+    print(f"{fine_agg['threshold_date'].notna().sum()} plates reached {violation_threshold} violations within {window_months} months")
+
+    # *********************
+    # save output
+    # *********************
+
+    fine_agg[fine_agg_amount_columns] = to_dollars(fine_agg[fine_agg_amount_columns])
 
-fine_agg.to_csv('../processed/fine_agg.csv', index=False)
+    # the integer key the tow cases are joined on
+    fine_agg['plate_key_id'] = plate_key_ids(fine_agg, plate_key)
 
+    fine_agg.to_csv('../processed/fine_agg.csv', index=False)
@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+from aggregate_fines import process_fines, judgement_date_diff_min, plate_key, sort_fine_agg
+from schema import read_fines_csv
+from dedup import fingerprint
+from rolling_violations import count_rolling_violations
+
+# *********************
+# constants
+# *********************
+
+# share of the memory budget given to each raw chunk,
+# the rest is left for partial aggregates and parsing overhead
+chunk_budget_share = 0.25
+
+# *********************
+# functions
+# *********************
+
+def get_chunksize(path, memory_budget_mb):
+    sample = read_fines_csv(path, 'aggregation', nrows=10_000)
+    bytes_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+
+    return max(int(memory_budget_mb * 1e6 * chunk_budget_share / bytes_per_row), 1_000)
+
+class SeenHashes:
+    """The hashes seen so far, as sorted runs.
+
+    A new run is merged into the one before it once it is as large, so every hash
+    is merged a logarithmic number of times rather than the whole set being
+    re-sorted on every chunk.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    @property
+    def nbytes(self):
+        return sum(run.nbytes for run in self.runs)
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            position = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[position] == hashes
+
+        return found
+
+    def add(self, hashes):
+        if len(hashes) == 0:
+            return
+
+        self.runs.append(np.unique(hashes))
+
+        while len(self.runs) > 1 and len(self.runs[-1]) >= len(self.runs[-2]):
+            run = self.runs.pop()
+            self.runs[-1] = np.union1d(self.runs[-1], run)
+
+def read_chunks(years, memory_budget_mb):
+    # yields each chunk with the bytes its duplicate detection holds, which the caller
+    # counts against the budget
+    for year in years:
+        path = f'../processed/school_zone_fines_{year}.csv'
+        chunksize = get_chunksize(path, memory_budget_mb)
+        print(f'year: {year} ({chunksize} rows per chunk)')
+
+        # duplicates are dropped within each year, as in process_fines
+        seen_rows = SeenHashes()
+        n_duplicates = 0
+
+        # dtypes are declared by the schema, so every chunk parses the same way
+        # and row hashes are comparable between chunks
+        for chunk in read_fines_csv(path, 'aggregation', chunksize=chunksize):
+            chunk = process_fines(chunk)
+
+            row_hash = fingerprint(chunk)
+            is_new = ~seen_rows.contains(row_hash)
+            seen_rows.add(row_hash[is_new])
+            n_duplicates += (~is_new).sum()
+
+            yield chunk[is_new], seen_rows.nbytes
+
+        print(f'Removed {n_duplicates} duplicates across chunks in {year} ({seen_rows.nbytes / 1e6:.0f} MB of row hashes)...')
+
+def first_seen(chunk, seen):
+    # flags the first occurrence of each (plate, summons) pair,
+    # so summing the flag gives a distinct summons count
+    pair_hash = pd.util.hash_pandas_object(chunk[plate_key + ['summons_number']], index=False).to_numpy()
+    _, first_index = np.unique(pair_hash, return_index=True)
+
+    is_first = np.zeros(len(chunk), dtype=bool)
+    is_first[first_index] = True
+    is_first &= ~seen.contains(pair_hash)
+    seen.add(pair_hash[is_first])
+
+    return is_first
+
+def combine(partials, keys):
+    return pd.concat(partials).groupby(keys, dropna=False, sort=False, observed=True).sum().reset_index()
+
+class PartialAggregate:
+    """Accumulates per-chunk groupby sums, compacting them once they outgrow the budget."""
+
+    def __init__(self, keys, memory_budget_mb):
+        self.keys = keys
+        self.budget_bytes = memory_budget_mb * 1e6 * chunk_budget_share
+        self.partials = []
+        self.partial_bytes = 0
+
+    def add(self, partial, reserved_bytes=0):
+        # reserved_bytes is memory held elsewhere that comes out of the same budget
+        self.partials.append(partial)
+        self.partial_bytes += partial.memory_usage(deep=True).sum()
+
+        if self.partial_bytes + reserved_bytes > self.budget_bytes and len(self.partials) > 1:
+            compacted = combine(self.partials, self.keys)
+            self.partials = [compacted]
+            self.partial_bytes = compacted.memory_usage(deep=True).sum()
+
+    def result(self):
+        return combine(self.partials, self.keys)
+
+def get_crossing_dates_from_daily(judgement_daily, threshold=350):
+    # summing in-judgement amounts by day keeps the first crossing day exact,
+    # since every in-judgement fine has a positive amount due.
+    # amounts are in cents, the threshold is in dollars
+    judgement_daily = judgement_daily.sort_values(plate_key + ['issue_date'])
+    judgement_daily['cumulative_due'] = judgement_daily.groupby(plate_key, observed=True)['amount_due'].cumsum()
+
+    crossing = judgement_daily[judgement_daily['cumulative_due'] > threshold * 100]
+    crossing = crossing.groupby(plate_key, observed=True).first().reset_index()
+
+    crossing['tow_eligible_date'] = crossing['issue_date'] + pd.Timedelta(days=judgement_date_diff_min)
+
+    return crossing[plate_key + ['tow_eligible_date']]
+
+def aggregate_fines_chunked(years, memory_budget_mb=1024):
+    """aggregate_fines over fines streamed in chunks sized to memory_budget_mb,
+    along with the rolling violation counts of every plate.
+
+    Memory isn't strictly bounded: duplicate detection keeps 8 bytes per distinct row
+    of the current year and per distinct (plate, summons) pair of the whole run. Those
+    bytes count against the budget, so partial aggregates compact sooner as they grow,
+    but they are never spilled.
+    """
+    # first pass: per plate totals, plus daily in-judgement sums to find crossings
+    # and daily violation counts for the rolling windows
+    totals = PartialAggregate(plate_key, memory_budget_mb)
+    judgement_daily = PartialAggregate(plate_key + ['issue_date'], memory_budget_mb)
+    violations_daily = PartialAggregate(plate_key + ['issue_date'], memory_budget_mb)
+    seen_summons = SeenHashes()
+
+    for chunk, row_hash_bytes in read_chunks(years, memory_budget_mb):
+        is_first = first_seen(chunk, seen_summons)
+        reserved_bytes = row_hash_bytes + seen_summons.nbytes
+
+        totals.add(chunk.assign(
+            violations=is_first,
+            fines_in_judgement=chunk['amount_due'].where(chunk['in_judgement'], 0),
+        ).groupby(plate_key, dropna=False, sort=False, observed=True).agg(
+            total_fines = ('total_fine', 'sum'),
+            amount_paid = ('payment_amount', 'sum'),
+            amount_due = ('amount_due', 'sum'),
+            violations = ('violations', 'sum'),
+            fines_in_judgement = ('fines_in_judgement', 'sum')
+        ).reset_index(), reserved_bytes)
+
+        judgement_daily.add(
+            chunk[chunk['in_judgement']].groupby(plate_key + ['issue_date'], sort=False, observed=True)['amount_due'].sum().reset_index(),
+            reserved_bytes
+        )
+
+        # a summons counts on the day it's first seen
+        violations_daily.add(
+            chunk[is_first].groupby(plate_key + ['issue_date'], sort=False, observed=True).size().rename('violations').reset_index(),
+            reserved_bytes
+        )
+
+    fine_agg = totals.result()
+    crossing_dates = get_crossing_dates_from_daily(judgement_daily.result())
+    rolling_violations = count_rolling_violations(violations_daily.result())
+
+    # second pass: fines issued after each eligible plate's tow eligible date
+    post_tow_eligible = PartialAggregate(plate_key, memory_budget_mb)
+    seen_summons = SeenHashes()
+
+    for chunk, row_hash_bytes in read_chunks(years, memory_budget_mb):
+        chunk = chunk.merge(crossing_dates, on=plate_key, how='inner')
+        chunk = chunk[chunk['issue_date'] > chunk['tow_eligible_date']]
+        is_first = first_seen(chunk, seen_summons)
+
+        post_tow_eligible.add(chunk.assign(violations=is_first).groupby(plate_key, sort=False, observed=True).agg(
+            total_fines_post_tow_eligible = ('total_fine', 'sum'),
+            amount_paid_post_tow_eligible = ('payment_amount', 'sum'),
+            amount_due_post_tow_eligible = ('amount_due', 'sum'),
+            violations_post_tow_eligible = ('violations', 'sum')
+        ).reset_index(), row_hash_bytes + seen_summons.nbytes)
+
+    # combine partial aggregates into the same layout as aggregate_fines
+    fine_agg = fine_agg.merge(crossing_dates, on=plate_key, how='left')
+    fine_agg = fine_agg.merge(post_tow_eligible.result(), on=plate_key, how='left')
+
+    # the judgement and post tow eligible groupbys in aggregate_fines drop missing keys
+    missing_key = fine_agg[plate_key].isna().any(axis=1)
+    fine_agg.loc[missing_key, 'fines_in_judgement'] = 0
+
+    post_columns = ['total_fines_post_tow_eligible', 'amount_paid_post_tow_eligible', 'amount_due_post_tow_eligible', 'violations_post_tow_eligible']
+    fine_agg[post_columns] = fine_agg[post_columns].fillna(0)
+    fine_agg['violations_post_tow_eligible'] = fine_agg['violations_post_tow_eligible'].astype(float)
+
+    fine_agg = fine_agg[
+        plate_key + ['tow_eligible_date', 'total_fines', 'amount_paid', 'amount_due', 'violations', 'fines_in_judgement'] + post_columns
+    ]
+
+    return sort_fine_agg(fine_agg), rolling_violations
@@ -0,0 +1,175 @@
+import duckdb
+
+from aggregate_fines import current_date, judgement_date_diff_min
+from money import amount_columns
+from schema import fines_views
+from rolling_violations import violation_threshold, window_months
+
+# *********************
+# queries
+# *********************
+
+# process_fines: parse dates, convert amounts to cents, total fines, 
+# judgement status and drop duplicates within each year
+process_fines_query = """
+create or replace temp table fines as
+with raw_fines as (
+    {yearly_reads}
+),
+fines_in_cents as (
+    select * replace (
+        try_strptime(issue_date, '%m/%d/%Y') as issue_date,
+        {cents_columns}
+    )
+    from raw_fines
+),
+deduped as (
+    select distinct * from fines_in_cents
+)
+select
+    * exclude (source_year),
+    fine_amount + penalty_amount + interest_amount - reduction_amount as total_fine,
+    coalesce(
+        date_diff('day', issue_date, $current_date) > $judgement_date_diff_min
+        and amount_due > 0,
+        false
+    ) as in_judgement
+from deduped
+"""
+
+yearly_read_query = """
+    select {year} as source_year, {columns}
+    from read_csv('{path}', header = true, types = {types})
+"""
+
+# get_threshold_crossing_dates: the first in-judgement fine that takes a plate's
+# cumulative amount due over the threshold (in cents), with plates missing a key left out
+threshold_crossing_query = """
+create or replace temp table crossing_dates as
+with cumulative as (
+    select
+        plate, state, license_type, issue_date,
+        sum(amount_due) over (
+            partition by plate, state, license_type
+            order by issue_date
+        ) as cumulative_due
+    from fines
+    where in_judgement
+        and plate is not null and state is not null and license_type is not null
+)
+select
+    plate, state, license_type,
+    min(issue_date) as crossing_date,
+    min(issue_date) + to_days($judgement_date_diff_min) as tow_eligible_date
+from cumulative
+where cumulative_due > $threshold
+group by all
+"""
+
+# aggregate_fines: totals, judgement and post tow eligible aggregates per plate
+aggregate_fines_query = """
+with fines_with_crossing as (
+    select
+        fines.*,
+        crossing_dates.tow_eligible_date,
+        coalesce(fines.issue_date > crossing_dates.tow_eligible_date, false) as post_tow_eligible,
+        fines.plate is not null and fines.state is not null and fines.license_type is not null as has_key
+    from fines
+    left join crossing_dates using (plate, state, license_type)
+),
+fine_agg as (
+    select
+        plate, state, license_type, tow_eligible_date,
+        coalesce(sum(total_fine), 0)::bigint as total_fines,
+        coalesce(sum(payment_amount), 0)::bigint as amount_paid,
+        coalesce(sum(amount_due), 0)::bigint as amount_due,
+        count(distinct summons_number) as violations,
+        coalesce(sum(amount_due) filter (in_judgement and has_key), 0)::bigint as fines_in_judgement,
+        coalesce(sum(total_fine) filter (post_tow_eligible and has_key), 0)::bigint as total_fines_post_tow_eligible,
+        coalesce(sum(payment_amount) filter (post_tow_eligible and has_key), 0)::bigint as amount_paid_post_tow_eligible,
+        coalesce(sum(amount_due) filter (post_tow_eligible and has_key), 0)::bigint as amount_due_post_tow_eligible,
+        count(distinct summons_number) filter (post_tow_eligible and has_key)::double as violations_post_tow_eligible
+    from fines_with_crossing
+    group by all
+)
+select
+    row_number() over (
+        order by plate, state, license_type, tow_eligible_date nulls last
+    ) - 1 as "index",
+    *
+from fine_agg
+order by "index"
+"""
+
+# get_rolling_violation_counts: per plate, the most violations in any window of months
+# ending on an issue date and the first date that reaches the threshold. a range frame
+# of months less a day starts the day after the same date that many months earlier
+rolling_violations_query = """
+with violations as (
+    -- a summons listed twice is still one violation, on the earliest date it's listed with
+    select plate, state, license_type, min(issue_date) as issue_date
+    from fines
+    where plate is not null and state is not null and license_type is not null
+    group by plate, state, license_type, summons_number
+),
+rolling as (
+    select
+        plate, state, license_type, issue_date,
+        count(*) over (
+            partition by plate, state, license_type
+            order by issue_date
+            range between interval {months} month - interval 1 day preceding and current row
+        ) as rolling_violations
+    from violations
+    where issue_date is not null
+)
+select
+    plate, state, license_type,
+    max(rolling_violations) as max_rolling_violations,
+    min(issue_date) filter (rolling_violations >= $threshold) as threshold_date
+from rolling
+group by all
+"""
+
+# *********************
+# functions
+# *********************
+
+def aggregate_fines_duckdb(years, threshold=350, con=None):
+    con = con or duckdb.connect()
+
+    types = '{' + ', '.join(
+        [f"'{column}': 'DOUBLE'" for column in amount_columns] + ["'issue_date': 'VARCHAR'"]
+    ) + '}'
+    # only the columns the pandas path reads, so duplicates are found on the same columns
+    columns = ', '.join(fines_views['aggregation']['usecols'])
+    paths = {year: f'../processed/school_zone_fines_{year}.csv' for year in years}
+    yearly_reads = '\n    union all by name\n'.join(
+        yearly_read_query.format(year=year, path=path, types=types, columns=columns) for year, path in paths.items()
+    )
+    cents_columns = ',\n        '.join(
+        f'round({column} * 100)::bigint as {column}' for column in amount_columns
+    )
+
+    print("Processing fines...")
+    con.execute(process_fines_query.format(yearly_reads=yearly_reads, cents_columns=cents_columns), {
+        'current_date': current_date.date(),
+        'judgement_date_diff_min': judgement_date_diff_min
+    })
+
+    print("Finding threshold crossing dates...")
+    con.execute(threshold_crossing_query, {
+        'judgement_date_diff_min': judgement_date_diff_min,
+        'threshold': threshold * 100
+    })
+
+    print("Aggregating fines...")
+    fine_agg = con.execute(aggregate_fines_query).df()
+
+    return fine_agg
+
+def get_rolling_violation_counts(con, threshold=violation_threshold, months=window_months):
+    # counted over the fines table aggregate_fines_duckdb left on the connection,
+    # so the csvs aren't read again
+    print("Counting rolling violations...")
+    return con.execute(rolling_violations_query.format(months=int(months)), {'threshold': threshold}).df()
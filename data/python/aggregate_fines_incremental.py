@@ -0,0 +1,158 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate_fines import (
+    process_fines, judgement_status, read_fines, get_threshold_crossing_dates,
+    broadcast_tow_eligible_dates, aggregate_fines, aggregate_plates,
+    current_date, judgement_date_diff_min, plate_key, agg_columns, sort_fine_agg
+)
+from money import fine_agg_amount_columns, to_dollars
+from schema import read_fines_csv, concat_fines
+
+# *********************
+# constants
+# *********************
+
+state_dir = '../processed/incremental'
+
+# *********************
+# functions
+# *********************
+
+# the state is the processed fines, fine_agg and the crossing table, all in cents.
+# fine_agg holds each plate's running and judgement sums and the crossing table its
+# crossing status and date. the fines are kept too, since a changed payment can lower
+# a plate's cumulative amount due and move its crossing to any earlier or later fine
+
+def state_path(name):
+    return os.path.join(state_dir, name)
+
+def load_state(years):
+    if not os.path.exists(state_path('state.json')):
+        return None
+
+    with open(state_path('state.json')) as f:
+        params = json.load(f)
+
+    # a different window or set of years changes every plate, so start over
+    if params['judgement_date_diff_min'] != judgement_date_diff_min or params['years'] != list(years):
+        return None
+
+    return (
+        pd.read_feather(state_path('fines.feather')),
+        pd.read_feather(state_path('fine_agg.feather')),
+        pd.read_feather(state_path('crossing_dates.feather'))
+    )
+
+def store_state(years, fines, fine_agg, crossing_dates):
+    os.makedirs(state_dir, exist_ok=True)
+
+    fines.reset_index(drop=True).to_feather(state_path('fines.feather'))
+    fine_agg.to_feather(state_path('fine_agg.feather'))
+    crossing_dates.reset_index(drop=True).to_feather(state_path('crossing_dates.feather'))
+
+    with open(state_path('state.json'), 'w') as f:
+        json.dump({
+            'current_date': str(current_date.date()),
+            'judgement_date_diff_min': judgement_date_diff_min,
+            'years': list(years)
+        }, f)
+
+def plate_hash(frame):
+    # a collision only adds a plate to the set that gets recomputed, which is harmless
+    return pd.util.hash_pandas_object(frame[plate_key], index=False).to_numpy()
+
+def aggregate_all(fines):
+    crossing_dates = get_threshold_crossing_dates(fines)
+
+    agg_fines = fines.copy()
+    broadcast_tow_eligible_dates(agg_fines, crossing_dates)
+
+    return aggregate_fines(agg_fines), crossing_dates
+
+def apply_delta(fines, fine_agg, crossing_dates, delta):
+    # fines age into judgement every day, which changes their plates even without new fines
+    in_judgement = judgement_status(fines)
+    aged = (in_judgement.fillna(False) != fines['in_judgement'].fillna(False)).to_numpy()
+    fines['in_judgement'] = in_judgement
+    print(f"{aged.sum()} fines aged into or out of judgement...")
+
+    # a delta row carries the current record of its summons, and replaces any stored rows for it
+    replaced = fines['summons_number'].isin(delta['summons_number']).to_numpy()
+    print(f"{len(delta)} new or changed fines, replacing {replaced.sum()} stored fines...")
+
+    affected = np.unique(np.concatenate([
+        plate_hash(fines[aged | replaced]),
+        plate_hash(delta)
+    ]))
+
+    fines = concat_fines([fines[~replaced], delta]).reset_index(drop=True)
+    is_affected = np.isin(plate_hash(fines), affected)
+    print(f"Re-aggregating {is_affected.sum()} fines...")
+
+    if not is_affected.any():
+        return fines, fine_agg, crossing_dates
+
+    affected_agg, affected_crossing_dates = aggregate_all(fines[is_affected].reset_index(drop=True))
+
+    # swap the affected plates' rows for the recomputed ones
+    fine_agg = concat_fines([
+        fine_agg[~np.isin(plate_hash(fine_agg), affected)],
+        affected_agg
+    ]).drop(columns='index')
+    crossing_dates = concat_fines([
+        crossing_dates[~np.isin(plate_hash(crossing_dates), affected)],
+        affected_crossing_dates
+    ]).sort_values(plate_key)
+
+    return fines, sort_fine_agg(fine_agg), crossing_dates
+
+def diff_against_full(fine_agg, years):
+    print("Verifying against a full recompute...")
+    full_agg = aggregate_plates(read_fines(years))
+
+    def to_csv(agg):
+        agg = agg.copy()
+        agg[fine_agg_amount_columns] = to_dollars(agg[fine_agg_amount_columns])
+        return agg.to_csv(index=False)
+
+    if to_csv(fine_agg) == to_csv(full_agg):
+        print("Incremental fine_agg matches the full recompute...")
+        return
+
+    incremental_rows = set(to_csv(fine_agg).splitlines())
+    full_rows = set(to_csv(full_agg).splitlines())
+    print("Incremental fine_agg differs from the full recompute:")
+    print(f"  {len(incremental_rows - full_rows)} rows only in the incremental result")
+    print(f"  {len(full_rows - incremental_rows)} rows only in the full recompute")
+
+    raise AssertionError("incremental fine_agg doesn't match the full recompute")
+
+def aggregate_fines_incremental(years, delta_path, verify=False):
+    state = load_state(years)
+
+    if state is None:
+        print("No incremental state, aggregating every year...")
+        fines = read_fines(years)[agg_columns].reset_index(drop=True)
+        fine_agg, crossing_dates = aggregate_all(fines)
+    else:
+        fines, fine_agg, crossing_dates = state
+
+        if os.path.exists(delta_path):
+            delta = process_fines(read_fines_csv(delta_path, 'aggregation'))[agg_columns]
+        else:
+            delta = fines.iloc[:0]
+
+        fines, fine_agg, crossing_dates = apply_delta(fines, fine_agg, crossing_dates, delta)
+
+    store_state(years, fines, fine_agg, crossing_dates)
+
+    # the source files are expected to already include the delta
+    if verify:
+        diff_against_full(fine_agg, years)
+
+    # the state fines are every fine in the source files, which later counts can use without re-reading them
+    return fines, fine_agg
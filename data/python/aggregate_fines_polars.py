@@ -0,0 +1,118 @@
+import polars as pl
+
+from aggregate_fines import current_date, judgement_date_diff_min, plate_key, agg_columns
+from money import amount_columns
+from dedup import fingerprint_columns
+from rolling_violations import violation_threshold, window_months
+
+# *********************
+# constants
+# *********************
+
+has_key = pl.all_horizontal(pl.col(plate_key).is_not_null())
+
+# *********************
+# functions
+# *********************
+
+def scan_year(year):
+    # read every column as a string so that the schema doesn't depend on inference,
+    # then convert the amounts to cents
+    fines = pl.scan_csv(
+        f'../processed/school_zone_fines_{year}.csv', infer_schema=False
+    ).with_columns((pl.col(amount_columns).cast(pl.Float64) * 100).round().cast(pl.Int64))
+
+    # duplicates are found on the same columns as the pandas path, 
+    # so only the columns we aggregate on are ever parsed
+    return process_fines(fines.unique(subset=fingerprint_columns, maintain_order=True))
+
+def process_fines(fines):
+    return fines.select(
+        pl.col(plate_key + ['summons_number', 'payment_amount', 'amount_due']),
+        pl.col('issue_date').str.strptime(pl.Date, '%m/%d/%Y', strict=False),
+        total_fine = (
+            pl.col('fine_amount') +
+            pl.col('penalty_amount') +
+            pl.col('interest_amount') -
+            pl.col('reduction_amount')
+        )
+    ).with_columns(
+        in_judgement = (
+            # fines have been issued for more than 75 days
+            ((pl.lit(current_date.date()) - pl.col('issue_date')).dt.total_days() > judgement_date_diff_min) &
+            # fines are still outstanding
+            (pl.col('amount_due') > 0)
+        ).fill_null(False)
+    ).select(agg_columns)
+
+def get_threshold_crossing_dates(fines, threshold=350):
+    # amounts are in cents, the threshold is in dollars
+    return (
+        fines
+        .filter(pl.col('in_judgement') & has_key)
+        .sort(plate_key + ['issue_date'])
+        .with_columns(cumulative_due = pl.col('amount_due').cum_sum().over(plate_key))
+        .filter(pl.col('cumulative_due') > threshold * 100)
+        .group_by(plate_key)
+        .agg(crossing_date = pl.col('issue_date').min())
+        .with_columns(tow_eligible_date = pl.col('crossing_date') + pl.duration(days=judgement_date_diff_min))
+    )
+
+def aggregate_fines(fines, crossing_dates):
+    fines = fines.join(crossing_dates, on=plate_key, how='left').with_columns(
+        post_tow_eligible = (pl.col('issue_date') > pl.col('tow_eligible_date')).fill_null(False) & has_key,
+        in_judgement = pl.col('in_judgement') & has_key
+    )
+
+    post_tow_eligible = pl.col('post_tow_eligible')
+
+    return fines.group_by(plate_key + ['tow_eligible_date']).agg(
+        total_fines = pl.col('total_fine').sum(),
+        amount_paid = pl.col('payment_amount').sum(),
+        amount_due = pl.col('amount_due').sum(),
+        violations = pl.col('summons_number').drop_nulls().n_unique().cast(pl.Int64),
+        fines_in_judgement = pl.col('amount_due').filter(pl.col('in_judgement')).sum(),
+        total_fines_post_tow_eligible = pl.col('total_fine').filter(post_tow_eligible).sum(),
+        amount_paid_post_tow_eligible = pl.col('payment_amount').filter(post_tow_eligible).sum(),
+        amount_due_post_tow_eligible = pl.col('amount_due').filter(post_tow_eligible).sum(),
+        violations_post_tow_eligible = pl.col('summons_number').filter(post_tow_eligible).drop_nulls().n_unique().cast(pl.Float64)
+    ).sort(plate_key + ['tow_eligible_date'], nulls_last=True)
+
+def aggregate_fines_polars(years, threshold=350):
+    fines = pl.concat([scan_year(year) for year in years])
+
+    crossing_dates = get_threshold_crossing_dates(fines, threshold).select(plate_key + ['tow_eligible_date'])
+
+    # both branches share the scan, which collect evaluates once
+    print("Aggregating fines...")
+    fine_agg = aggregate_fines(fines, crossing_dates).collect().to_pandas()
+
+    return fine_agg.reset_index()
+
+def get_rolling_violation_counts(years, threshold=violation_threshold, months=window_months):
+    # only the columns the counts need are parsed, and polars keeps the windows in the engine.
+    # a rolling period of months covers the day after the same date that many months earlier
+    # up to and including the issue date, and every fine issued that day
+    fines = pl.concat([
+        pl.scan_csv(f'../processed/school_zone_fines_{year}.csv', infer_schema=False).select(plate_key + ['summons_number', 'issue_date'])
+        for year in years
+    ]).with_columns(pl.col('issue_date').str.strptime(pl.Date, '%m/%d/%Y', strict=False))
+
+    rolling_violations = (
+        fines
+        .filter(has_key & pl.col('issue_date').is_not_null())
+        # a summons listed twice is still one violation, on the earliest date it's listed with
+        .group_by(plate_key + ['summons_number'])
+        .agg(pl.col('issue_date').min())
+        .sort(plate_key + ['issue_date'])
+        .rolling(index_column='issue_date', period=f'{months}mo', group_by=plate_key)
+        .agg(rolling_violations = pl.len())
+        .group_by(plate_key)
+        .agg(
+            max_rolling_violations = pl.col('rolling_violations').max().cast(pl.Int64),
+            threshold_date = pl.col('issue_date').filter(pl.col('rolling_violations') >= threshold).min()
+        )
+    )
+
+    print("Counting rolling violations...")
+    return rolling_violations.collect().to_pandas()
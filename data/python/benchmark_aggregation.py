@@ -0,0 +1,58 @@
+import time
+import os
+
+from aggregate_fines import read_fines, aggregate_plates, aggregate_fines_partitioned, years
+from aggregate_fines_duckdb import aggregate_fines_duckdb
+from aggregate_fines_polars import aggregate_fines_polars
+
+# *********************
+# constants
+# *********************
+
+n_workers = os.cpu_count()
+
+# *********************
+# functions
+# *********************
+
+def time_it(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f'{label}: {elapsed:.2f}s')
+    return result, elapsed
+
+# *********************
+# benchmark
+# *********************
+
+if __name__ == '__main__':
+
+    # every read parses the csvs, otherwise the first read fills the cache and every later one,
+    # the baseline for the duckdb and polars backends included, only times loading it back
+    serial_fines, serial_read_time = time_it('serial read', read_fines, years, n_workers=1, cache=False)
+    parallel_fines, parallel_time = time_it(f'parallel read ({n_workers} workers)', read_fines, years, n_workers=n_workers, cache=False)
+
+    assert serial_fines.equals(parallel_fines)
+
+    print(f'read speedup: {serial_read_time / parallel_time:.2f}x')
+
+    serial_agg, serial_agg_time = time_it('serial aggregation', aggregate_plates, serial_fines)
+    partitioned_agg, partitioned_time = time_it(f'partitioned aggregation ({n_workers} shards)', aggregate_fines_partitioned, serial_fines, n_workers)
+
+    assert serial_agg.equals(partitioned_agg)
+
+    print(f'aggregation speedup: {serial_agg_time / partitioned_time:.2f}x')
+
+    # the duckdb backend covers the whole pipeline, so compare it against read + aggregate
+    duckdb_agg, duckdb_time = time_it('duckdb backend', aggregate_fines_duckdb, years)
+
+    assert serial_agg.to_csv(index=False) == duckdb_agg.to_csv(index=False)
+
+    print(f'duckdb speedup: {(serial_read_time + serial_agg_time) / duckdb_time:.2f}x')
+
+    polars_agg, polars_time = time_it('polars backend', aggregate_fines_polars, years)
+
+    assert serial_agg.to_csv(index=False) == polars_agg.to_csv(index=False)
+
+    print(f'polars speedup: {(serial_read_time + serial_agg_time) / polars_time:.2f}x')
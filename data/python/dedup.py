@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from money import amount_columns
+
+# *********************
+# constants
+# *********************
+
+# a summons number identifies a fine, so together with its date, amounts and plate details
+# it fingerprints a row without hashing every plate string
+fingerprint_columns = ['summons_number', 'state', 'license_type', 'issue_date'] + amount_columns
+
+fingerprint_multiplier = np.uint64(0x100000001b3)
+
+# *********************
+# functions
+# *********************
+
+def column_words(column):
+    # one 64 bit word per value, which only depends on the value itself
+    # so that fingerprints are comparable between chunks and years
+    if column.dtype.kind == 'M':
+        return column.to_numpy().view(np.uint64)
+    if column.dtype.kind in 'iu':
+        return column.to_numpy(dtype=np.int64, na_value=np.iinfo(np.int64).min).view(np.uint64)
+    if column.dtype.kind == 'f':
+        return column.to_numpy(dtype=np.float64, na_value=np.nan).view(np.uint64)
+
+    # strings and categoricals
+    return pd.util.hash_pandas_object(column, index=False).to_numpy()
+
+def fingerprint(fines):
+    # fold the columns into one word per row, then hash it once,
+    # rather than hashing and combining every column separately
+    columns = [column for column in fingerprint_columns if column in fines]
+
+    row_words = np.zeros(len(fines), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in columns:
+            row_words = row_words * fingerprint_multiplier + column_words(fines[column])
+
+    return pd.util.hash_array(row_words)
+
+def drop_duplicate_fines(fines):
+    is_duplicate = pd.Series(fingerprint(fines)).duplicated().to_numpy()
+    print(f"Removed {is_duplicate.sum()} duplicates...")
+
+    return fines[~is_duplicate]
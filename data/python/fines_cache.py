@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# *********************
+# constants
+# *********************
+
+cache_dir = '../processed/cache'
+cache_max_mb = 2048
+
+# bump whenever process_fines changes in a way that affects its output
+cache_version = 5
+
+# *********************
+# functions
+# *********************
+
+def file_digest(path):
+    # hashing a multi-GB file takes seconds, so remember the digest
+    # for as long as the file's size and modification time are unchanged
+    stat = os.stat(path)
+    stat_key = hashlib.blake2b(
+        f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'.encode(), digest_size=16
+    ).hexdigest()
+    digest_path = os.path.join(cache_dir, 'digests', stat_key)
+
+    if os.path.exists(digest_path):
+        with open(digest_path) as f:
+            return f.read()
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+            digest.update(block)
+    digest = digest.hexdigest()
+
+    os.makedirs(os.path.dirname(digest_path), exist_ok=True)
+    write_atomic(digest_path, lambda tmp_path: open(tmp_path, 'w').write(digest))
+
+    return digest
+
+def cache_key(path, params):
+    params = json.dumps({**params, 'cache_version': cache_version}, sort_keys=True, default=str)
+
+    return hashlib.blake2b(f'{file_digest(path)}|{params}'.encode(), digest_size=16).hexdigest()
+
+def cache_path(key):
+    return os.path.join(cache_dir, f'{key}.feather')
+
+def write_atomic(path, write):
+    # write to a temporary file first so that concurrent workers never read a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load(key):
+    path = cache_path(key)
+
+    # another worker may evict the entry at any point, which is the same as a miss
+    try:
+        # mark as recently used for eviction
+        os.utime(path)
+
+        # read_feather hands strings back as python objects, this keeps plates arrow-backed
+        # as read_fines_csv reads them, so cached and freshly parsed years are the same
+        string_dtypes = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+
+        return feather.read_table(path).to_pandas(types_mapper=string_dtypes.get)
+    except FileNotFoundError:
+        return None
+
+def store(key, df):
+    os.makedirs(cache_dir, exist_ok=True)
+    write_atomic(cache_path(key), lambda tmp_path: df.to_feather(tmp_path))
+    evict()
+
+def entry_stats(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return path, stat.st_mtime, stat.st_size
+
+def evict(max_mb=None):
+    # workers store years at the same time, so any entry may already be gone
+    # by the time it is looked at or removed here
+    max_mb = cache_max_mb if max_mb is None else max_mb
+
+    entries = [
+        entry_stats(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir) if name.endswith('.feather')
+    ]
+    # least recently used entries go first
+    entries = sorted([entry for entry in entries if entry is not None], key=lambda entry: entry[1], reverse=True)
+
+    total_bytes = 0
+    for path, _, size in entries:
+        total_bytes += size
+        if total_bytes > max_mb * 1e6:
+            print(f'Evicting {path} from cache...')
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
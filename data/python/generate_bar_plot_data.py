@@ -2,11 +2,15 @@ import pandas as pd
 import numpy as np
 from scipy import stats
 
+from money import amount_columns, to_cents, to_dollars
+from schema import read_fines_csv
+from dedup import drop_duplicate_fines
+
 
 # ******************
 # read in
 # ******************
-fines = pd.read_csv('../processed/school_zone_fines_2024.csv')
+fines = read_fines_csv('../processed/school_zone_fines_2024.csv', 'bar_plot')
 
 # ******************
 # clean
@@ -15,6 +19,10 @@ fines = pd.read_csv('../processed/school_zone_fines_2024.csv')
 
 fines['issue_date'] = pd.to_datetime(fines['issue_date'])
 
+# amounts are summed in cents, and converted back to dollars on save
+for column in amount_columns:
+    fines[column] = to_cents(fines[column])
+
 fines['total_fine'] = (
     fines['fine_amount'] + 
     fines['penalty_amount'] + 
@@ -22,7 +30,7 @@ fines['total_fine'] = (
     fines['reduction_amount']
 )
 
-fines = fines.drop_duplicates()
+fines = drop_duplicate_fines(fines)
 
 print(f'unique years: {fines.issue_date.dt.year.unique()}')
 
@@ -90,5 +98,12 @@ plot_data['penalty_share'] = (plot_data['total_penalties'] / plot_data['total_fi
 # save
 # ******************
 
+dollar_columns = [
+    'fines_paid', 'total_fines', 'total_penalties', 'total_interest',
+    'average_fines', 'average_penalties', 'average_interest',
+    'outstanding_fines', 'average_outstanding_fine'
+]
+plot_data[dollar_columns] = to_dollars(plot_data[dollar_columns])
+
 plot_data.to_csv('../../static/data/bar_plot_data.csv', index=False)
 
@@ -1,13 +1,13 @@
-import pandas as pd
+from schema import read_fines_csv, concat_fines
 
 # *********************
 # data read in 
 # *********************
 
-fines = pd.concat([
-    pd.read_csv('../processed/school_zone_fines_2023.csv'),
-    pd.read_csv('../processed/school_zone_fines_2024.csv'),
-    pd.read_csv('../processed/school_zone_fines_2025.csv')
+fines = concat_fines([
+    read_fines_csv('../processed/school_zone_fines_2023.csv', 'granular_plate'),
+    read_fines_csv('../processed/school_zone_fines_2024.csv', 'granular_plate'),
+    read_fines_csv('../processed/school_zone_fines_2025.csv', 'granular_plate')
 ])
 
 # *********************
@@ -3,13 +3,28 @@ import datetime as dt
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-import random
+
+from scofftow import read_action_index
+from tow_timeline import read_action_timeline, first_action_after
+from sampling import sample_daily, seed
+from plate_matching import match_path
+from scroll_metrics import scroll_metrics, write_metrics
+
+# *********************
+# constants
+# *********************
+
+fuzzy_plate_matches = False # also joins plates to the tow cases of their misspellings, found by plate_matching.py
 
 # *********************
 # data read in 
 # *********************
 
-tow_cases = pd.read_csv('../processed/scofftow_case_information.csv')
+# first and last boot or tow of every plate, precomputed by scofftow.py
+tow_action_index = read_action_index(columns=['plate_key_id', 'first_action_date', 'last_action_date'])
+
+# every boot and tow, sorted by date
+tow_action_timeline = read_action_timeline()
 
 fine_agg = pd.read_csv('../processed/fine_agg.csv')
 
@@ -17,28 +32,39 @@ fine_agg = pd.read_csv('../processed/fine_agg.csv')
 # clean
 # *********************
 
-tow_cases.boot_date = pd.to_datetime(tow_cases.boot_date)
-tow_cases.tow_date = pd.to_datetime(tow_cases.tow_date)
 fine_agg.tow_eligible_date = pd.to_datetime(fine_agg.tow_eligible_date)
 
-tow_cases['first_action_date'] = tow_cases[['boot_date', 'tow_date']].min(axis=1)
-tow_cases['last_action_date'] = tow_cases[['boot_date', 'tow_date']].max(axis=1)
-
-unique_tow_plates = tow_cases.groupby(['plate_id', 'license_plate_issuing_state', 'license_plate_type']).agg(
-  first_action_date = ('first_action_date', 'min'),
-  last_action_date = ('last_action_date', 'max')
-).reset_index()
-
 # *********************
 # filter 
 # *********************
 
-fine_agg_with_tows = fine_agg.merge(
-  unique_tow_plates,
-  left_on=['plate', 'state', 'license_type'],
-  right_on=['plate_id', 'license_plate_issuing_state', 'license_plate_type'], 
-  how='left')
+# both sides carry the same integer plate key, so the join is an array lookup.
+# plates without a tow case (-1) pick up the trailing NaT
+tow_plate_key_ids = fine_agg.plate_key_id.to_numpy()
 
+if fuzzy_plate_matches:
+  # plates matched to a misspelling of theirs are looked up by the misspelling's key
+  plate_matches = pd.read_parquet(match_path, columns=['plate_key_id', 'tow_plate_key_id'])
+  match = pd.Index(plate_matches.plate_key_id).get_indexer(tow_plate_key_ids)
+  matched_key_ids = np.append(plate_matches.tow_plate_key_id.to_numpy(), 0)[match]
+  tow_plate_key_ids = np.where(match >= 0, matched_key_ids, tow_plate_key_ids)
+  print(f"{(match >= 0).sum()} plates matched to a tow case by a misspelled plate")
+
+position = pd.Index(tow_action_index.plate_key_id).get_indexer(tow_plate_key_ids)
+
+fine_agg_with_tows = fine_agg.assign(**{
+  column: np.append(tow_action_index[column].to_numpy(), np.datetime64('NaT'))[position]
+  for column in ['first_action_date', 'last_action_date']
+})
+
+# how many plates the key matches, from either side
+has_tow_case = position >= 0
+print(f"{has_tow_case.sum()} of {len(fine_agg)} plates with fines have a tow case ({has_tow_case.mean():.1%})")
+print(f"{has_tow_case[fine_agg.tow_eligible_date.notna().to_numpy()].mean():.1%} of tow eligible plates have a tow case")
+print(f"{tow_action_index.plate_key_id.isin(tow_plate_key_ids).mean():.1%} of plates with a tow case have fines")
+
+# first boot or tow on or after each plate's tow eligible date, and how many days it took
+fine_agg_with_tows = fine_agg_with_tows.join(first_action_after(fine_agg_with_tows.assign(plate_key_id=tow_plate_key_ids), tow_action_timeline))
 
 # plates that require towing
 plates_to_tow = fine_agg_with_tows[fine_agg_with_tows.tow_eligible_date.notna()]
@@ -46,7 +72,7 @@ plates_to_tow = fine_agg_with_tows[fine_agg_with_tows.tow_eligible_date.notna()]
 plates_to_tow = plates_to_tow[plates_to_tow.tow_eligible_date.dt.year == 2024]
 
 # plates that were not towed
-non_tows = fine_agg_with_tows[(fine_agg_with_tows.last_action_date.isna()) | (fine_agg_with_tows.last_action_date < fine_agg_with_tows.tow_eligible_date)]
+non_tows = fine_agg_with_tows[fine_agg_with_tows.next_action_date.isna()]
 
 non_tows = non_tows[non_tows.tow_eligible_date.dt.year == 2024]
 
@@ -63,103 +89,41 @@ comparison_df = plates_to_tow.merge(
 # metric
 # *********************
 
-print(f"""
-      {
-        non_tows.shape[0] / plates_to_tow.shape[0]
-      } share of plates not towed post eligibility
-      """)
-
-print(f"""
-      {
-        non_tows.shape[0] 
-      } total plates not towed post eligibility
-      """)
-
-print(f"""
-      {
-        non_tows.amount_due_post_tow_eligible.sum()
-      } total fines due post tow eligible, 
-      from {
-        non_tows.violations_post_tow_eligible.sum()
-      } violations post tow eligible
-      """)
-
-print(f"""
-      { round(
-        non_tows.amount_due.sum(), 0)
-      } total fines due, 
-      """)
-
-print(f"""
-      {
-        non_tows.amount_due_post_tow_eligible.sum() / non_tows.amount_due.sum()
-      } share of total fines not paid post tow eligible
-      """)
+# every headline number of the story in one pass, written out for the page to load
+metrics = scroll_metrics(plates_to_tow, non_tows)
 
+for name, value in metrics.items():
+  print(f"{name}: {value}")
 
-
-post_eligible_plates = plates_to_tow[plates_to_tow.violations_post_tow_eligible > 0]
-
-post_eligible_non_tows = non_tows[non_tows.violations_post_tow_eligible > 0]
-
-print(f"""
-    share of plates with violations post tow eligible date: 
-    
-      {
-        post_eligible_plates.shape[0] / plates_to_tow.shape[0]} or {post_eligible_plates.shape[0]} plates
-""")
-
-print(f"""
-    share of non-towed plates with violations post tow eligible date: 
-    
-      {
-        post_eligible_non_tows.shape[0] / non_tows.shape[0]} or {post_eligible_non_tows.shape[0]} plates
-""")
-
-print(f"""
-      stats among these non-towed plates:
-
-     {
-        round(post_eligible_non_tows.violations.mean(), 2)
-      } violations on average
-
-
-      {
-        round(post_eligible_non_tows.violations_post_tow_eligible.mean(), 2)
-      } violations post tow eligible on average
-      """)
-
-violation_post_tow_eligible_share = post_eligible_non_tows.shape[0] / non_tows.shape[0]
+violation_post_tow_eligible_share = metrics['share_not_towed_with_violations_post_tow_eligible'] or 0
 
 # *********************
 # sample
 # *********************
 
-fine_agg_daily_sample = pd.DataFrame()
-
-for date in non_tows.tow_eligible_date.unique():
-    non_tows_date = non_tows[non_tows.tow_eligible_date == date]
-
-    n_plates = non_tows_date.shape[0]
-    if (random.random() < violation_post_tow_eligible_share):
-        sample_plate = non_tows_date[non_tows_date.violations_post_tow_eligible > 0].sample(1)
-
-        sample_plate['n_plates'] = n_plates
+# one plate per tow eligible date, drawn from plates with violations post tow eligible
+# as often as those plates occur among all non-towed plates
+fine_agg_daily_sample = sample_daily(
+  non_tows,
+  'tow_eligible_date',
+  stratum=non_tows.violations_post_tow_eligible > 0,
+  stratum_share=violation_post_tow_eligible_share,
+  seed=seed,
+  id_columns=['plate_key_id']
+)
 
-        fine_agg_daily_sample = pd.concat([fine_agg_daily_sample, sample_plate])
-    else:
-        sample_plate = non_tows_date[non_tows_date.violations_post_tow_eligible == 0].sample(1)
-        sample_plate['n_plates'] = n_plates
-        fine_agg_daily_sample = pd.concat([fine_agg_daily_sample, sample_plate])
+fine_agg_daily_sample['n_plates'] = fine_agg_daily_sample.tow_eligible_date.map(non_tows.tow_eligible_date.value_counts())
 
 
 # *********************
 # save
 # *********************
 
-plates_to_tow.to_csv('../../static/data/plates_to_tow.csv', index=False)
+plates_to_tow.drop(columns='plate_key_id').to_csv('../../static/data/plates_to_tow.csv', index=False)
+
+fine_agg_daily_sample.drop(columns='plate_key_id').to_csv('../../static/data/plates_to_tow_daily_sample.csv', index=False)
 
-fine_agg_daily_sample.to_csv('../../static/data/plates_to_tow_daily_sample.csv', index=False)
+write_metrics(metrics)
 
 
 
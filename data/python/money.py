@@ -0,0 +1,31 @@
+import numpy as np
+
+# *********************
+# constants
+# *********************
+
+# amounts as they appear in the raw fines
+amount_columns = [
+    'fine_amount', 'penalty_amount', 'interest_amount',
+    'reduction_amount', 'payment_amount', 'amount_due'
+]
+
+# amounts as they appear in fine_agg
+fine_agg_amount_columns = [
+    'total_fines', 'amount_paid', 'amount_due', 'fines_in_judgement',
+    'total_fines_post_tow_eligible', 'amount_paid_post_tow_eligible', 'amount_due_post_tow_eligible'
+]
+
+# *********************
+# functions
+# *********************
+
+# amounts are carried as integer cents so that sums and threshold comparisons are exact,
+# and only converted back to dollars when written out
+
+def to_cents(dollars):
+    # nullable integers keep missing amounts missing, as they were as floats
+    return np.round(dollars * 100).astype('Int64')
+
+def to_dollars(cents):
+    return cents.astype(float) / 100
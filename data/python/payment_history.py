@@ -0,0 +1,304 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregate_fines import years
+from fines_cache import write_atomic
+from money import to_cents
+from schema import read_fines_csv
+from dedup import column_words
+
+# *********************
+# constants
+# *********************
+
+history_dir = '../processed/payment_history'
+
+# amounts that change after a summons is issued, as it's paid off or accrues interest
+tracked_columns = ['payment_amount', 'interest_amount', 'amount_due']
+
+# fold the segments into one file once there are this many
+max_segments = 32
+
+# rows per record batch of a segment, the unit a summons lookup decodes
+batch_rows = 16_384
+
+# *********************
+# functions
+# *********************
+
+# every upsert appends a segment holding only the summonses that are new or whose
+# tracked amounts changed, tagged with an increasing version and the date they were observed.
+# segment names carry the first and last date observed in them, so an as-of view only reads
+# the segments observed by then.
+# latest.feather keeps the most recent version of every summons, sorted by summons number,
+# so that an upsert compares against it instead of rescanning the history.
+# segments are sorted by summons number too, and their metadata holds the first summons of
+# every record batch, so a summons lookup only decodes the batches that can hold it
+
+def segment_path(kind, version, observed_dates):
+    first, last = observed_dates.min(), observed_dates.max()
+
+    return os.path.join(history_dir, f'{kind}_{version:06d}_{first:%Y%m%d}_{last:%Y%m%d}.feather')
+
+def segment_version(path):
+    return int(os.path.basename(path).split('.')[0].split('_')[1])
+
+def segment_dates(path):
+    parts = os.path.basename(path).split('.')[0].split('_')
+
+    # segments written before their names carried dates could hold any date
+    if len(parts) < 4:
+        return pd.Timestamp.min, pd.Timestamp.max
+
+    return pd.Timestamp(parts[2]), pd.Timestamp(parts[3])
+
+def list_segments():
+    compacted = sorted(glob.glob(os.path.join(history_dir, 'compacted_*.feather')), key=segment_version)
+    segments = sorted(glob.glob(os.path.join(history_dir, 'segment_*.feather')), key=segment_version)
+
+    if not compacted:
+        return segments
+
+    # segments already folded into the newest compacted file are left over from an interrupted compaction
+    compacted_version = segment_version(compacted[-1])
+    return [compacted[-1]] + [path for path in segments if segment_version(path) > compacted_version]
+
+def write_segment(segment, path):
+    # segment is sorted by summons number
+    table = pa.Table.from_pandas(segment, preserve_index=False)
+    batches = table.to_batches(max_chunksize=batch_rows)
+    first_summons = [batch.column('summons_number')[0].as_py() for batch in batches]
+    schema = table.schema.with_metadata({**table.schema.metadata, b'first_summons': json.dumps(first_summons).encode()})
+
+    def write(tmp_path):
+        # still a feather file, which pd.read_feather reads whole
+        with pa.ipc.new_file(tmp_path, schema, options=pa.ipc.IpcWriteOptions(compression='lz4')) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+    write_atomic(path, write)
+
+def expand_ranges(start, end):
+    # every position in each [start, end) range
+    lengths = end - start
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return np.repeat(start, lengths) + offsets
+
+def read_summons(path, summons_numbers):
+    # every row of a segment for the given sorted summons numbers
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        metadata = reader.schema.metadata or {}
+
+        if b'first_summons' in metadata:
+            # a summons's versions run from the last batch starting before it
+            # to the last batch starting at or before it
+            first_summons = np.array(json.loads(metadata[b'first_summons']), dtype=np.int64)
+            first_batch = np.maximum(np.searchsorted(first_summons, summons_numbers, side='left') - 1, 0)
+            end_batch = np.maximum(np.searchsorted(first_summons, summons_numbers, side='right'), first_batch)
+        else:
+            # segments written before they carried the index
+            first_batch = np.zeros(len(summons_numbers), dtype=np.int64)
+            end_batch = np.full(len(summons_numbers), reader.num_record_batches)
+
+        batches = []
+        for batch_id in np.unique(expand_ranges(first_batch, end_batch)):
+            # both ends only grow with the summons number, so the summonses a batch
+            # can hold are a contiguous run of them
+            in_batch = summons_numbers[
+                np.searchsorted(end_batch, batch_id, side='right'):np.searchsorted(first_batch, batch_id, side='right')
+            ]
+
+            batch = reader.get_batch(batch_id)
+            batch_summons = batch.column('summons_number').to_numpy()
+            positions = expand_ranges(
+                np.searchsorted(batch_summons, in_batch, side='left'),
+                np.searchsorted(batch_summons, in_batch, side='right')
+            )
+            batches.append(batch.take(positions))
+
+        return pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+def read_history():
+    segments = list_segments()
+    if not segments:
+        return None
+
+    # every segment is sorted by summons number and they are read in version order,
+    # so a stable sort orders each summons's versions oldest first
+    history = pd.concat([pd.read_feather(path) for path in segments], ignore_index=True)
+    history = history.sort_values('summons_number', kind='stable', ignore_index=True)
+
+    return history
+
+def latest():
+    path = os.path.join(history_dir, 'latest.feather')
+    if not os.path.exists(path):
+        return None
+
+    return pd.read_feather(path)
+
+def last_positions(segment, until):
+    # the row of each summons's last version observed on or before until,
+    # for a segment sorted by summons number with versions oldest first
+    positions = np.flatnonzero(segment['observed_date'].to_numpy() <= until.to_datetime64())
+    summons_numbers = segment['summons_number'].to_numpy()[positions]
+
+    is_last = np.ones(len(positions), dtype=bool)
+    is_last[:-1] = summons_numbers[1:] != summons_numbers[:-1]
+
+    return positions[is_last]
+
+def merge_latest(older, newer, older_positions):
+    # the older rows at older_positions and the newer rows, both sorted by summons number with
+    # one row per summons, merged in that order with newer rows replacing older ones. newer rows
+    # are placed by binary search and the result is taken in one go, so nothing is sorted again
+    older_summons = older['summons_number'].to_numpy()[older_positions]
+    newer_summons = newer['summons_number'].to_numpy()
+
+    position = np.minimum(np.searchsorted(older_summons, newer_summons), max(len(older_summons) - 1, 0))
+    replaced = np.zeros(len(older_summons), dtype=bool)
+    if len(older_summons):
+        replaced[position[older_summons[position] == newer_summons]] = True
+
+    # each newer row goes in front of the older rows that sort after it
+    newer_at = np.searchsorted(older_summons[~replaced], newer_summons) + np.arange(len(newer))
+    is_newer = np.zeros(len(older_summons) - replaced.sum() + len(newer), dtype=bool)
+    is_newer[newer_at] = True
+
+    order = np.empty(len(is_newer), dtype=np.int64)
+    order[~is_newer] = older_positions[~replaced]
+    order[is_newer] = len(older) + np.arange(len(newer))
+
+    return pd.concat([older, newer], ignore_index=True).take(order).reset_index(drop=True)
+
+def as_of(date):
+    # the most recent version of every summons observed on or before date,
+    # from the segments first observed by then, the others are never read.
+    # each segment is already sorted by summons number, so its last versions are
+    # found on their own and merged in version order
+    date = pd.Timestamp(date)
+    segments = list_segments()
+    if not segments:
+        return None
+
+    observed = [path for path in segments if segment_dates(path)[0] <= date]
+    if not observed:
+        return read_summons(segments[0], np.array([], dtype=np.int64))
+
+    history = pd.read_feather(observed[0])
+    positions = last_positions(history, date)
+
+    if len(observed) == 1:
+        return history.take(positions).reset_index(drop=True)
+
+    # the first segment is the compacted history or the first pull and the later ones hold
+    # only changes, which are few enough to sort together before being merged into it once
+    changes = pd.concat([pd.read_feather(path) for path in observed[1:]], ignore_index=True)
+    changes = changes.sort_values('summons_number', kind='stable', ignore_index=True)
+    changes = changes.take(last_positions(changes, date))
+
+    return merge_latest(history, changes, positions)
+
+def summons_history(summons_numbers):
+    # every version of the given summonses, oldest first. each segment only decodes the batches
+    # that can hold them, and the few rows found are merged
+    segments = list_segments()
+    if not segments:
+        return None
+
+    summons_numbers = np.unique(np.asarray(summons_numbers, dtype=np.int64))
+    history = pd.concat([read_summons(path, summons_numbers) for path in segments], ignore_index=True)
+
+    return history.sort_values('summons_number', kind='stable', ignore_index=True)
+
+def changed_rows(pull, current):
+    # new summonses, and summonses whose tracked amounts differ from their latest version
+    if current is None or current.empty:
+        return np.ones(len(pull), dtype=bool)
+
+    current_summons = current['summons_number'].to_numpy()
+    position = np.searchsorted(current_summons, pull['summons_number'].to_numpy())
+    position = np.minimum(position, len(current) - 1)
+
+    found = current_summons[position] == pull['summons_number'].to_numpy()
+
+    changed = ~found
+    for column in tracked_columns:
+        changed |= column_words(pull[column]) != column_words(current[column]).take(position)
+
+    return changed
+
+def upsert(pull, observed_date):
+    # a pull may list a summons more than once, the last row is taken as its state
+    pull = pull[['summons_number'] + tracked_columns].drop_duplicates('summons_number', keep='last')
+    pull = pull.sort_values('summons_number', ignore_index=True)
+
+    current = latest()
+    changed = changed_rows(pull, current)
+
+    segments = list_segments()
+    version = segment_version(segments[-1]) + 1 if segments else 1
+
+    changes = pull[changed].assign(version=version, observed_date=pd.Timestamp(observed_date))
+    changes = changes[['summons_number', 'version', 'observed_date'] + tracked_columns].reset_index(drop=True)
+    print(f"{len(changes)} new or changed summonses out of {len(pull)}...")
+
+    if changes.empty:
+        return
+
+    os.makedirs(history_dir, exist_ok=True)
+    write_segment(changes, segment_path('segment', version, changes['observed_date']))
+
+    # swap in the new versions, keeping latest sorted by summons number
+    if current is not None:
+        unchanged = ~current['summons_number'].isin(changes['summons_number'])
+        changes = pd.concat([current[unchanged], changes], ignore_index=True)
+        changes = changes.sort_values('summons_number', kind='stable', ignore_index=True)
+    write_atomic(os.path.join(history_dir, 'latest.feather'), lambda tmp_path: changes.to_feather(tmp_path))
+
+    if len(segments) + 1 >= max_segments:
+        compact()
+
+def compact():
+    segments = list_segments()
+    history = read_history()
+    version = segment_version(segments[-1])
+
+    compacted_path = segment_path('compacted', version, history['observed_date'])
+
+    print(f"Compacting {len(segments)} segments...")
+    write_segment(history, compacted_path)
+
+    for path in segments:
+        if path != compacted_path:
+            os.remove(path)
+
+def read_pull(year):
+    path = f'../processed/school_zone_fines_{year}.csv'
+    pull = read_fines_csv(path, 'payment_history')
+
+    for column in tracked_columns:
+        pull[column] = to_cents(pull[column])
+
+    # the file is overwritten on every download, so its modification date is when it was observed
+    observed_date = pd.Timestamp(os.path.getmtime(path), unit='s').normalize()
+
+    return pull, observed_date
+
+if __name__ == '__main__':
+
+    # *********************
+    # add the latest download of every year
+    # *********************
+
+    for year in years:
+        print(f'year: {year}')
+        pull, observed_date = read_pull(year)
+        upsert(pull, observed_date)
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+# *********************
+# functions
+# *********************
+
+# the fines and the scofftow cases spell the same plate with their own columns, case and spacing,
+# so both are reduced to one integer key at ingest and joined on that instead of on strings
+
+def normalize_plate_part(column):
+    # upper case without any whitespace, done once per distinct value rather than per row.
+    # missing values (-1) pick up the trailing empty string, so they still match each other
+    codes, uniques = pd.factorize(column)
+    normalized = pd.Series(uniques.astype(str), dtype=object).str.upper().str.replace(r'\s+', '', regex=True)
+
+    return np.append(normalized.to_numpy(dtype=object), '')[codes]
+
+def plate_key_ids(frame, columns):
+    """One int64 per row, the same for every spelling of a plate, state and license type
+    that normalizes to the same strings.
+
+    A 64 bit hash of the normalized parts rather than a lookup table, so the fines and the
+    tow cases get the same key without sharing any state. Collisions are vanishingly unlikely
+    at a few million plates.
+    """
+    normalized = pd.DataFrame({column: normalize_plate_part(frame[column]) for column in columns})
+
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy().view(np.int64)
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from aggregate_fines import plate_key
+from plate_keys import normalize_plate_part
+from scofftow import read_tow_cases, tow_plate_key
+
+# *********************
+# constants
+# *********************
+
+# fine plates matched to the tow case plates they are a misspelling of
+match_path = '../processed/plate_matches.parquet'
+
+# characters read for each other when a plate is written down,
+# folded together for blocking and cheaper to swap when scoring
+confusables = {'O': '0', 'Q': '0', 'I': '1', 'L': '1'}
+confusable_cost = 0.5
+
+# an edit is a substitution, insertion, deletion or swap of neighbouring characters
+max_distance = 1
+# shorter plates are one edit away from too many others to match on
+min_plate_length = 4
+
+block_multiplier = np.uint64(0x100000001b3)
+
+# *********************
+# functions
+# *********************
+
+# comparing every tow plate against every fine plate is out of the question, so candidates are
+# blocked: both sides are indexed by state, license type and the plate with confusables folded,
+# whole and with each one character left out. two plates one edit apart share at least one of
+# those keys, so only plates that share a key are scored
+
+def normalized_plates(plates):
+    plates = plates.drop_duplicates('plate_key_id', ignore_index=True)
+
+    return pd.DataFrame({
+        'plate_key_id': plates['plate_key_id'].to_numpy(),
+        **{column: pd.array(normalize_plate_part(plates[column]), dtype='string[pyarrow]') for column in plate_key}
+    })
+
+def read_plates():
+    fine_plates = pd.read_csv('../processed/fine_agg.csv', usecols=plate_key + ['plate_key_id'], dtype={column: str for column in plate_key})
+    tow_plates = read_tow_cases(columns=tow_plate_key + ['plate_key_id']).rename(columns=dict(zip(tow_plate_key, plate_key)))
+
+    return normalized_plates(fine_plates), normalized_plates(tow_plates)
+
+def fold_confusables(plates):
+    for character, replacement in confusables.items():
+        plates = plates.str.replace(character, replacement, regex=False)
+
+    return plates
+
+def blocking_keys(plates):
+    # one batch of (key, row) pairs per left out position, the first being the whole plate,
+    # so the larger side never has all of its keys in memory at once
+    folded = fold_confusables(plates['plate'])
+    lengths = folded.str.len().to_numpy()
+    # pandas slices arrow strings one python string at a time, arrow's own kernels don't
+    folded = pa.array(folded, type=pa.string())
+    rows = np.arange(len(plates))
+
+    # state and license type are the same for every variant, so they're hashed once and mixed in.
+    # two different keys colliding only costs scoring a pair that doesn't match
+    block_hashes = pd.util.hash_pandas_object(plates[['state', 'license_type']], index=False).to_numpy() * block_multiplier
+
+    for position in range(-1, lengths.max(initial=0)):
+        has = lengths > position
+        variant = folded.filter(has)
+        if position >= 0:
+            variant = pc.binary_join_element_wise(
+                pc.utf8_slice_codeunits(variant, 0, position),
+                pc.utf8_slice_codeunits(variant, position + 1, np.iinfo(np.int32).max),
+                ''
+            )
+        variant = pd.Series(pd.arrays.ArrowStringArray(variant))
+
+        # almost every variant is distinct, so factorizing them before hashing would only cost time
+        yield pd.util.hash_pandas_object(variant, index=False, categorize=False).to_numpy() ^ block_hashes[has], rows[has]
+
+def candidate_pairs(fine_plates, tow_plates):
+    # the tow plates are the smaller side, so their keys are sorted once
+    # and every batch of fine plate keys is looked up with binary searches
+    tow_keys, tow_rows = [np.concatenate(arrays) for arrays in zip(*blocking_keys(tow_plates))]
+    order = np.argsort(tow_keys, kind='stable')
+    tow_keys = tow_keys[order]
+    tow_rows = tow_rows[order]
+
+    # most fine plate keys aren't shared with any tow plate, and a hash lookup drops
+    # them far faster than binary searching all of them
+    shared_keys = pd.Index(np.unique(tow_keys))
+
+    fine_pairs, tow_pairs = [], []
+    for fine_keys, fine_rows in blocking_keys(fine_plates):
+        is_shared = shared_keys.get_indexer(fine_keys) >= 0
+        fine_keys = fine_keys[is_shared]
+        fine_rows = fine_rows[is_shared]
+
+        start = np.searchsorted(tow_keys, fine_keys, side='left')
+        end = np.searchsorted(tow_keys, fine_keys, side='right')
+
+        # expand each [start, end) range into positions
+        lengths = end - start
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        fine_pairs.append(np.repeat(fine_rows, lengths))
+        tow_pairs.append(tow_rows[np.repeat(start, lengths) + offsets])
+
+    # plates sharing more than one key are one candidate
+    pairs = np.unique(np.concatenate(fine_pairs).astype(np.int64) * len(tow_plates) + np.concatenate(tow_pairs))
+
+    return pairs // len(tow_plates), pairs % len(tow_plates)
+
+def substitution_cost(a, b):
+    if a == b:
+        return 0
+    if confusables.get(a, a) == confusables.get(b, b):
+        return confusable_cost
+
+    return 1
+
+def plate_distance(a, b):
+    """Optimal string alignment distance, where swapping confusable characters costs less than an edit."""
+    distances = [[i + j if i == 0 or j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            distances[i][j] = min(
+                distances[i - 1][j] + 1,
+                distances[i][j - 1] + 1,
+                distances[i - 1][j - 1] + substitution_cost(a[i - 1], b[j - 1])
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distances[i][j] = min(distances[i][j], distances[i - 2][j - 2] + 1)
+
+    return distances[-1][-1]
+
+def match_plates(fine_plates, tow_plates):
+    """Fine plates without a tow case, matched to the tow case plate without fines they are one edit from.
+
+    A plate with more than one equally close candidate on the other side is left unmatched,
+    rather than guessing which one it is.
+    """
+    # plates that already match exactly aren't misspellings
+    is_fine_candidate = ~fine_plates['plate_key_id'].isin(tow_plates['plate_key_id']) & (fine_plates['plate'].str.len() >= min_plate_length)
+    is_tow_candidate = ~tow_plates['plate_key_id'].isin(fine_plates['plate_key_id']) & (tow_plates['plate'].str.len() >= min_plate_length)
+
+    fine_plates = fine_plates[is_fine_candidate].reset_index(drop=True)
+    tow_plates = tow_plates[is_tow_candidate].reset_index(drop=True)
+
+    fine_rows, tow_rows = candidate_pairs(fine_plates, tow_plates)
+    print(f"Scoring {len(fine_rows)} candidate pairs...")
+
+    fine_plate_ids = fine_plates['plate'].to_numpy(dtype=object)[fine_rows]
+    tow_plate_ids = tow_plates['plate'].to_numpy(dtype=object)[tow_rows]
+    candidates = pd.DataFrame({
+        'fine_row': fine_rows,
+        'tow_row': tow_rows,
+        'distance': [plate_distance(a, b) for a, b in zip(fine_plate_ids, tow_plate_ids)]
+    })
+    candidates = candidates[candidates['distance'] <= max_distance]
+
+    # the closest candidates of every plate, on either side, and only where there is one
+    for row in ['tow_row', 'fine_row']:
+        candidates = candidates[candidates['distance'] == candidates.groupby(row)['distance'].transform('min')]
+        candidates = candidates[~candidates[row].duplicated(keep=False)]
+
+    fine_matched = fine_plates.iloc[candidates['fine_row']].reset_index(drop=True)
+    tow_matched = tow_plates.iloc[candidates['tow_row']].reset_index(drop=True)
+
+    return pd.DataFrame({
+        'plate_key_id': fine_matched['plate_key_id'],
+        'tow_plate_key_id': tow_matched['plate_key_id'],
+        'plate': fine_matched['plate'],
+        'tow_plate': tow_matched['plate'],
+        'state': fine_matched['state'],
+        'license_type': fine_matched['license_type'],
+        'distance': candidates['distance'].to_numpy()
+    })
+
+if __name__ == '__main__':
+
+    # *********************
+    # data read in
+    # *********************
+
+    fine_plates, tow_plates = read_plates()
+
+    # *********************
+    # match
+    # *********************
+
+    print("Matching plates...")
+    plate_matches = match_plates(fine_plates, tow_plates)
+
+    print(f"{len(plate_matches)} fine plates matched to a tow case plate they are one edit from")
+
+    # *********************
+    # save output
+    # *********************
+
+    plate_matches.to_parquet(match_path, index=False)
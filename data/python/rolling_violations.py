@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+from aggregate_fines import plate_key
+
+# *********************
+# constants
+# *********************
+
+# the dangerous vehicle abatement program's school zone speed camera rule,
+# 15 violations within 12 months
+violation_threshold = 15
+window_months = 12
+
+# *********************
+# functions
+# *********************
+
+def count_rolling_violations(daily_violations, threshold=violation_threshold, months=window_months):
+    """Per plate, the most violations in any window of `months` ending on an issue date,
+    and the first issue date on which that count reaches `threshold`.
+
+    `daily_violations` has a row per plate and issue date with the number of violations
+    on it, and windows run from the day after the same date `months` earlier up to and
+    including the issue date, so fines issued on the same day all count towards it.
+    """
+    # plates with a missing key part aren't grouped, as in the judgement threshold
+    daily_violations = daily_violations.dropna(subset=['issue_date'])
+    group_ids = daily_violations.groupby(plate_key, observed=True, sort=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    has_key = group_ids >= 0
+    group_ids = group_ids[has_key]
+    violations = daily_violations['violations'].to_numpy(dtype=np.int64)[has_key]
+    issue_dates = pd.DatetimeIndex(daily_violations['issue_date'].to_numpy()[has_key])
+    window_starts = issue_dates - pd.DateOffset(months=months)
+
+    # one sorted int64 key per row, plate first and date second, so every window
+    # is a contiguous run found with two binary searches over the whole table
+    epoch = min(issue_dates.min(), window_starts.min()) if len(issue_dates) else pd.Timestamp(0)
+    days = (issue_dates - epoch).days.to_numpy().astype(np.int64)
+    start_days = (window_starts - epoch).days.to_numpy().astype(np.int64)
+    stride = days.max() + 1 if len(days) else 1
+
+    keys = group_ids * stride + days
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    group_ids = group_ids[order]
+    issue_dates = issue_dates[order]
+
+    # the violations in a window are the difference of the running total at its ends
+    cumulative = np.append(0, np.cumsum(violations[order]))
+    window_start = np.searchsorted(keys, group_ids * stride + start_days[order], side='right')
+    window_end = np.searchsorted(keys, keys, side='right')
+    rolling_counts = cumulative[window_end] - cumulative[window_start]
+
+    # per plate maximum, over runs of the sorted group ids
+    plate_starts = np.flatnonzero(np.append(True, group_ids[1:] != group_ids[:-1]))
+    max_counts = np.maximum.reduceat(rolling_counts, plate_starts) if len(plate_starts) else rolling_counts[:0]
+
+    # the first row in each plate's run that reaches the threshold
+    reached = np.flatnonzero(rolling_counts >= threshold)
+    reached_groups, first_reached = np.unique(group_ids[reached], return_index=True)
+    first_dates = np.full(len(plate_starts), np.datetime64('NaT'), dtype='datetime64[ns]')
+    first_dates[reached_groups] = issue_dates[reached[first_reached]].to_numpy()
+
+    plates = daily_violations[plate_key][has_key].iloc[order].iloc[plate_starts].reset_index(drop=True)
+
+    return plates.assign(
+        max_rolling_violations = max_counts,
+        threshold_date = first_dates
+    )
+
+def get_rolling_violation_counts(fines, threshold=violation_threshold, months=window_months):
+    # a summons listed twice is still one violation, on the earliest date it's listed with,
+    # though after process_fines there is usually one row per summons already
+    fines = fines[plate_key + ['summons_number', 'issue_date']].dropna(subset=['issue_date'])
+    if not fines['summons_number'].is_unique:
+        fines = fines.sort_values('issue_date', kind='stable').drop_duplicates(plate_key + ['summons_number'])
+
+    # every fine is a day's worth of violations on its own, which the windows add up the same
+    return count_rolling_violations(fines.assign(violations=1), threshold, months)
+
+def add_rolling_violations(fine_agg, rolling_violations):
+    # look up each plate's counts by its key, as broadcast_tow_eligible_dates does.
+    # plates without counts (-1), those with a missing key part, pick up the trailing 0 and NaT
+    rolling_index = pd.MultiIndex.from_frame(rolling_violations[plate_key])
+    position = rolling_index.get_indexer(pd.MultiIndex.from_frame(fine_agg[plate_key]))
+
+    threshold_dates = rolling_violations['threshold_date'].to_numpy().astype('datetime64[ns]')
+
+    fine_agg['max_rolling_violations'] = np.append(rolling_violations['max_rolling_violations'].to_numpy(dtype=np.int64), 0)[position]
+    fine_agg['threshold_date'] = np.append(threshold_dates, np.datetime64('NaT'))[position]
+
+    return fine_agg
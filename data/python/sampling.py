@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# *********************
+# constants
+# *********************
+
+seed = 2024 # every sampled artifact draws from this, so unchanged inputs rebuild byte for byte
+
+# *********************
+# functions
+# *********************
+
+def seeded_uniforms(values, seed):
+    """A number in [0, 1) for every row of `values`, fixed by the row's values and the seed.
+
+    Hashing rather than drawing from a generator in row order means a row gets the
+    same number however many other rows there are or whatever order they come in.
+    """
+    hashes = pd.util.hash_pandas_object(values, index=False, hash_key=f'{seed:016x}'[-16:]).to_numpy()
+
+    # the top 53 bits, as many as a double holds exactly
+    return (hashes >> np.uint64(11)) * 2.0**-53
+
+def sample_daily(frame, date_column, stratum, stratum_share, seed, id_columns):
+    """One row per date, drawn from the rows where `stratum` holds with probability
+    `stratum_share` and from the rest otherwise.
+
+    Every row gets a random key and the lowest key wins, so one sort picks a row
+    for every (date, stratum) pair at once instead of filtering the frame per date.
+    A date without rows in the drawn stratum falls back to the other one.
+
+    The draws for a date are seeded by `seed` and the date itself, and a row's key
+    by its `id_columns`, so a date's pick only changes when that date's rows do.
+    """
+    candidates = frame.assign(
+        _stratum=np.asarray(stratum, dtype=bool),
+        _key=seeded_uniforms(frame[[date_column] + id_columns], seed)
+    )
+    candidates = candidates.sort_values([date_column, '_stratum', '_key'], kind='stable')
+    candidates = candidates.drop_duplicates([date_column, '_stratum'])
+
+    # draw a stratum for every date, and put the drawn stratum's row first
+    dates = candidates[date_column].drop_duplicates()
+    drawn = pd.Series(seeded_uniforms(dates, seed) < stratum_share, index=dates.to_numpy())
+    candidates['_drawn'] = candidates['_stratum'].to_numpy() == drawn.loc[candidates[date_column]].to_numpy()
+
+    sample = candidates.sort_values([date_column, '_drawn'], ascending=[True, False], kind='stable')
+    sample = sample.drop_duplicates(date_column)
+
+    return sample.drop(columns=['_stratum', '_key', '_drawn'])
@@ -0,0 +1,88 @@
+import pandas as pd
+
+from money import amount_columns
+
+# *********************
+# constants
+# *********************
+
+# every column of the school zone fines, as downloaded
+fines_columns = [
+    'plate', 'state', 'license_type', 'summons_number', 'issue_date',
+    'violation_time', 'violation', 'judgment_entry_date', 'fine_amount',
+    'penalty_amount', 'interest_amount', 'reduction_amount', 'payment_amount',
+    'amount_due', 'precinct', 'county', 'issuing_agency', 'summons_image',
+    'violation_status'
+]
+
+# low-cardinality columns of the school zone fines, repeated millions of times over
+fines_category_columns = [
+    'state', 'license_type', 'county', 'precinct',
+    'issuing_agency', 'violation', 'violation_status'
+]
+
+fines_dtypes = {
+    'plate': 'string[pyarrow]',
+    'summons_number': 'int64',
+    **{column: 'category' for column in fines_category_columns},
+    **{column: 'float64' for column in amount_columns}
+}
+
+# the columns each consumer reads, so that parsing time and memory
+# scale with what is actually used rather than the full file
+fines_views = {
+    'aggregation': {
+        'usecols': ['plate', 'state', 'license_type', 'summons_number', 'issue_date'] + amount_columns,
+        'parse_dates': ['issue_date']
+    },
+    'bar_plot': {
+        'usecols': ['plate', 'summons_number', 'issue_date'] + amount_columns,
+        'parse_dates': ['issue_date']
+    },
+    'payment_history': {
+        'usecols': ['summons_number', 'payment_amount', 'interest_amount', 'amount_due'],
+        'parse_dates': []
+    },
+    # written back out as is, so every column is kept and numbers and dates aren't reformatted
+    'granular_plate': {
+        'usecols': fines_columns,
+        'dtype': {
+            'plate': 'string[pyarrow]',
+            **{column: 'category' for column in fines_category_columns}
+        },
+        'parse_dates': []
+    }
+}
+
+# *********************
+# functions
+# *********************
+
+def read_fines_csv(path, view, **kwargs):
+    view = fines_views[view]
+    usecols = view['usecols']
+    dtype = view.get('dtype', fines_dtypes)
+
+    return pd.read_csv(
+        path,
+        usecols=usecols,
+        dtype={column: dtype[column] for column in usecols if column in dtype},
+        parse_dates=view['parse_dates'],
+        date_format='%m/%d/%Y',
+        **kwargs
+    )
+
+def concat_fines(frames):
+    # each year has its own set of categories, and concat falls back to objects
+    # when they differ, so put every frame on the union of categories first
+    frames = list(frames)
+
+    for column in fines_category_columns:
+        if not all(column in frame for frame in frames):
+            continue
+
+        categories = sorted(set().union(*(frame[column].cat.categories for frame in frames)))
+        dtype = pd.CategoricalDtype(categories)
+        frames = [frame.astype({column: dtype}) for frame in frames]
+
+    return pd.concat(frames)
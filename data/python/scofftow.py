@@ -1,39 +1,311 @@
+import glob
+import io
+import json
+import os
+import re
+
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from plate_keys import plate_key_ids
 
 # *********************
-# data read in 
+# constants
 # *********************
 
-# sourced from https://data.cityofnewyork.us/City-Government/DOF-Scofftow-Case-Information/qmh3-uvgq/about_data
-df = pd.read_csv('../raw/DOF_Scofftow_Case_Information_20250924.csv')
+# sourced from https://data.cityofnewyork.us/City-Government/DOF-Scofftow-Case-Information/qmh3-uvgq/about_data,
+# each download is stamped with its date, e.g. DOF_Scofftow_Case_Information_20250924.csv
+raw_pattern = '../raw/DOF_Scofftow_Case_Information_*.csv'
+# parquet keeps dates and booleans typed, so downstream stages load it without re-parsing
+output_path = '../processed/scofftow_case_information.parquet'
+
+# first and last boot or tow of every plate, by the integer plate key the fines also carry
+action_index_path = '../processed/tow_action_index.parquet'
+tow_plate_key = ['plate_id', 'license_plate_issuing_state', 'license_plate_type']
+
+text_columns = ['case_number', 'plate_id', 'license_plate_issuing_state', 'license_plate_type', 'borough']
+flag_columns = ['towed', 'redeemed', 'auctioned']
+
+# the snapshot the processed cases were cleaned from, whose rows they are stored in the order of,
+# so that a new snapshot only has its new or changed rows cleaned
+snapshot_state_path = '../processed/scofftow_snapshot.json'
+change_log_path = '../processed/scofftow_changes.csv'
+case_key = 'Case Number'
+
+# streams the raw file in chunks instead of loading it into memory. refreshing from the previous
+# snapshot holds both raw files and the processed cases in memory, so it is skipped in this mode,
+# every snapshot is processed in full and no change log is written
+chunked = False
+chunksize = 500_000 # rows per chunk in the chunked mode
+n_workers = 1 # > 1 cleans and formats chunks in their own processes
 
 # *********************
-# data cleaning
+# functions
 # *********************
 
-# make all column names lowercase and replace spaces with underscores
-df.columns = df.columns.str.lower().str.replace(' ', '_')
+def read_cases(path, **kwargs):
+    # every column is read as text, so that plates and case numbers come back out
+    # exactly as they went in, and every chunk parses the same way
+    return pd.read_csv(path, dtype=str, **kwargs)
 
-df['boot_date'] = pd.to_datetime(df['boot_date'])
-df['tow_date'] = pd.to_datetime(df['tow_date'])
-df['auction_date'] = pd.to_datetime(df['auction_date'])
+def parse_dates(column):
+    # there are far fewer distinct dates than cases, so parse each one once.
+    # missing dates (-1) pick up the trailing NaT
+    codes, uniques = pd.factorize(column)
+    dates = pd.to_datetime(uniques, format='%m/%d/%Y', errors='coerce').to_numpy()
 
-df = df.rename(columns=
-               {'license_plate_number': 'plate_id',
-                'tow_(y/n)': 'towed', 
-                'redeemed_(y/n)': 'redeemed',
-                'auctioned_(y/n)': 'auctioned',
-                })
+    # the downloads have been plain dates so far, anything else (e.g. with a time)
+    # is parsed the way the format would have been inferred before
+    unmatched = np.isnat(dates)
+    if unmatched.any():
+        dates[unmatched] = pd.to_datetime(uniques[unmatched], format='mixed').to_numpy()
 
-df['towed'] = df['towed'].map({'Y': True, 'N': False})
-df['redeemed'] = df['redeemed'].map({'Y': True, 'N': False})
-df['auctioned'] = df['auctioned'].map({'Y': True, 'N': False})
+    dates = np.append(dates, np.datetime64('NaT'))
 
-# *********************
-# save output
-# *********************
+    return pd.Series(dates[codes], index=column.index)
+
+def clean_cases(df):
+    # make all column names lowercase and replace spaces with underscores
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+
+    df['boot_date'] = parse_dates(df['boot_date'])
+    df['tow_date'] = parse_dates(df['tow_date'])
+    df['auction_date'] = parse_dates(df['auction_date'])
+
+    df = df.rename(columns=
+                   {'license_plate_number': 'plate_id',
+                    'tow_(y/n)': 'towed',
+                    'redeemed_(y/n)': 'redeemed',
+                    'auctioned_(y/n)': 'auctioned',
+                    })
+
+    df['towed'] = df['towed'].map({'Y': True, 'N': False})
+    df['redeemed'] = df['redeemed'].map({'Y': True, 'N': False})
+    df['auctioned'] = df['auctioned'].map({'Y': True, 'N': False})
+
+    # declared rather than inferred, so a chunk where a column is all missing
+    # still has the same types as every other chunk
+    df = df.astype({
+        **{column: 'string[pyarrow]' for column in text_columns},
+        **{column: 'boolean' for column in flag_columns}
+    })
+
+    df['plate_key_id'] = plate_key_ids(df, tow_plate_key)
+
+    return df
+
+def clean_chunk(chunk):
+    # converting to arrow is as costly as cleaning, so workers return finished tables
+    return pa.Table.from_pandas(clean_cases(chunk), preserve_index=False)
+
+def write_tables(tables, output_path):
+    writer = None
+
+    # one row group per chunk
+    for table in tables:
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+
+    if writer is not None:
+        writer.close()
+
+def clean_tables(chunks, n_workers):
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # a few chunks in flight per worker, written back in order,
+            # so memory stays bounded however long the file is
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(clean_chunk, chunk))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for chunk in chunks:
+            yield clean_chunk(chunk)
+
+def clean_cases_chunked(raw_path, output_path, chunksize=chunksize, n_workers=n_workers):
+    chunks = read_cases(raw_path, chunksize=chunksize)
+
+    write_tables(clean_tables(chunks, n_workers), output_path)
+
+def read_typed(path, columns=None):
+    # text stays in arrow memory rather than being copied out into python strings
+    string_dtypes = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+
+    return pq.read_table(path, columns=columns).to_pandas(types_mapper=string_dtypes.get)
+
+def read_tow_cases(columns=None, path=output_path):
+    return read_typed(path, columns)
+
+def read_action_index(columns=None, path=action_index_path):
+    return read_typed(path, columns)
+
+def build_action_index(cases):
+    action_index = cases.groupby('plate_key_id').agg(
+        first_boot_date = ('boot_date', 'min'),
+        first_tow_date = ('tow_date', 'min'),
+        last_boot_date = ('boot_date', 'max'),
+        last_tow_date = ('tow_date', 'max'),
+        cases = ('boot_date', 'size')
+    )
+
+    # fmin and fmax skip a missing boot or tow, as min(axis=1) would, without going row by row
+    action_index['first_action_date'] = np.fmin(action_index['first_boot_date'], action_index['first_tow_date'])
+    action_index['last_action_date'] = np.fmax(action_index['last_boot_date'], action_index['last_tow_date'])
+
+    return action_index[['first_boot_date', 'first_tow_date', 'first_action_date', 'last_action_date', 'cases']].reset_index()
+
+def snapshot_stamp(path):
+    return re.search(r'_(\d{8})\.csv$', path).group(1)
+
+def newest_snapshot():
+    return max(glob.glob(raw_pattern), key=snapshot_stamp)
+
+def snapshot_path(stamp):
+    return raw_pattern.replace('*', stamp)
+
+def read_snapshot_state():
+    if not os.path.exists(snapshot_state_path) or not os.path.exists(output_path):
+        return None
+
+    # cases processed before they carried a plate key are processed again in full
+    if 'plate_key_id' not in pq.read_schema(output_path).names:
+        return None
+
+    with open(snapshot_state_path) as f:
+        return json.load(f)['snapshot']
+
+def store_snapshot_state(raw_path):
+    with open(snapshot_state_path, 'w') as f:
+        json.dump({'snapshot': snapshot_stamp(raw_path)}, f)
+
+def read_lines(path):
+    with open(path, 'rb') as f:
+        return f.read().splitlines()
+
+def parse_lines(header, lines):
+    return read_cases(io.BytesIO(b'\n'.join([header] + lines)))
+
+def log_changes(raw_path, changes):
+    changes = pd.DataFrame({
+        'snapshot': snapshot_stamp(raw_path),
+        'case_number': np.concatenate(list(changes.values())),
+        'change': np.repeat(list(changes.keys()), [len(cases) for cases in changes.values()])
+    })
+
+    changes.to_csv(change_log_path, mode='a', header=not os.path.exists(change_log_path), index=False)
+
+def refresh_cases(raw_path, previous_path):
+    """Cleans only the rows that are new or changed since the previous snapshot.
+
+    Every row is cleaned on its own, so a raw line that is unchanged since the previous
+    snapshot is carried over from the processed cases by its position there. Returns False
+    if the snapshots can't be lined up, in which case the new one is processed in full.
+
+    Both raw files, every previous line and the processed cases are held in memory,
+    which is why the chunked mode doesn't refresh.
+    """
+    header, *lines = read_lines(raw_path)
+    previous_header, *previous_lines = read_lines(previous_path)
+    cases = read_tow_cases()
+    if header != previous_header or len(previous_lines) != len(cases):
+        return False
+
+    # comparing raw lines is far cheaper than parsing and hashing every field
+    previous_positions = {line: position for position, line in enumerate(previous_lines)}
+    positions = np.fromiter((previous_positions.get(line, -1) for line in lines), dtype=np.int64, count=len(lines))
+
+    is_stale = positions < 0
+    is_unmatched = np.ones(len(previous_lines), dtype=bool)
+    is_unmatched[positions[~is_stale]] = False
+
+    delta = parse_lines(header, [line for line, stale in zip(lines, is_stale) if stale])
+    removed = parse_lines(previous_header, [previous_lines[position] for position in np.flatnonzero(is_unmatched)])
+
+    # a quoted line break would split a case over two lines
+    if len(delta) != is_stale.sum() or len(removed) != is_unmatched.sum():
+        return False
+
+    # a case in both is one that changed
+    is_changed = delta[case_key].isin(removed[case_key]).to_numpy()
+    is_removed = ~removed[case_key].isin(delta[case_key]).to_numpy()
+    print(f"{(~is_changed).sum()} new, {is_changed.sum()} changed and {is_removed.sum()} removed cases...")
+    changes = {
+        'new': delta[case_key].to_numpy()[~is_changed],
+        'changed': delta[case_key].to_numpy()[is_changed],
+        'removed': removed[case_key].to_numpy()[is_removed]
+    }
+
+    # in the same order as the snapshot, as if it had been processed in full
+    positions[is_stale] = len(cases) + np.arange(is_stale.sum())
+    if not delta.empty:
+        cases = pd.concat([cases, clean_cases(delta)], ignore_index=True)
+    cases = cases.take(positions).reset_index(drop=True)
+    cases.to_parquet(output_path, index=False)
+
+    store_snapshot_state(raw_path)
+    log_changes(raw_path, changes)
+
+    return True
+
+if __name__ == '__main__':
+
+    raw_path = newest_snapshot()
+    print(f'snapshot: {snapshot_stamp(raw_path)}')
+    previous = read_snapshot_state()
+
+    if previous == snapshot_stamp(raw_path) and os.path.exists(action_index_path):
+
+        print("Snapshot already processed...")
+
+    else:
+
+        can_refresh = not chunked and previous is not None and os.path.exists(snapshot_path(previous))
+
+        if not can_refresh or not refresh_cases(raw_path, snapshot_path(previous)):
+
+            if chunked:
+
+                # *********************
+                # read, clean and save chunk by chunk
+                # *********************
+
+                clean_cases_chunked(raw_path, output_path)
+
+            else:
+
+                # *********************
+                # data read in
+                # *********************
+
+                df = read_cases(raw_path)
+
+                # *********************
+                # data cleaning
+                # *********************
+
+                df = clean_cases(df)
+
+                # *********************
+                # save output
+                # *********************
 
-df.to_csv('../processed/scofftow_case_information.csv', index=False)
+                df.to_parquet(output_path, index=False)
 
+            # remember the snapshot, so that the next one only cleans what changed
+            store_snapshot_state(raw_path)
 
+        # *********************
+        # per plate tow action index
+        # *********************
 
+        action_index = build_action_index(read_tow_cases(columns=['plate_key_id', 'boot_date', 'tow_date']))
+        action_index.to_parquet(action_index_path, index=False)
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+
+# *********************
+# constants
+# *********************
+
+# loaded by the page, so the numbers quoted in the story come from the data rather than being copied over
+metrics_path = '../../static/data/scroll_metrics.json'
+# bumped whenever a metric is added, removed or changes meaning
+metrics_version = 1
+
+# *********************
+# functions
+# *********************
+
+def share(part, whole):
+    # json has no nan, and an empty year has no shares
+    return part / whole if whole else None
+
+def scroll_metrics(plates_to_tow, non_tows):
+    """The headline numbers of the scroll, for plates that became tow eligible and plates that weren't towed after.
+
+    Each column is pulled out once and every number is derived from those arrays,
+    rather than filtering the frames again for each one.
+    """
+    violations_post = non_tows['violations_post_tow_eligible'].to_numpy()
+    has_violations_post = violations_post > 0
+    amount_due = non_tows['amount_due'].to_numpy().sum()
+    amount_due_post = non_tows['amount_due_post_tow_eligible'].to_numpy().sum()
+    n_plates_with_violations_post = int((plates_to_tow['violations_post_tow_eligible'].to_numpy() > 0).sum())
+    n_non_tows_with_violations_post = int(has_violations_post.sum())
+
+    return {
+        'plates_to_tow': len(plates_to_tow),
+        'plates_not_towed': len(non_tows),
+        'share_not_towed': share(len(non_tows), len(plates_to_tow)),
+        'amount_due_not_towed': amount_due,
+        'amount_due_post_tow_eligible_not_towed': amount_due_post,
+        'share_amount_due_post_tow_eligible_not_towed': share(amount_due_post, amount_due),
+        'violations_post_tow_eligible_not_towed': int(violations_post.sum()),
+        'plates_with_violations_post_tow_eligible': n_plates_with_violations_post,
+        'share_with_violations_post_tow_eligible': share(n_plates_with_violations_post, len(plates_to_tow)),
+        'plates_not_towed_with_violations_post_tow_eligible': n_non_tows_with_violations_post,
+        'share_not_towed_with_violations_post_tow_eligible': share(n_non_tows_with_violations_post, len(non_tows)),
+        # among plates not towed that kept getting violations
+        'mean_violations': share(non_tows['violations'].to_numpy()[has_violations_post].sum(), n_non_tows_with_violations_post),
+        'mean_violations_post_tow_eligible': share(violations_post[has_violations_post].sum(), n_non_tows_with_violations_post)
+    }
+
+def write_metrics(metrics, path=metrics_path):
+    # rounded and in a fixed order, so unchanged inputs write the same bytes
+    metrics = {
+        name: round(float(value), 4) if isinstance(value, (float, np.floating)) else value
+        for name, value in metrics.items()
+    }
+
+    with open(path, 'w') as f:
+        json.dump({'version': metrics_version, 'metrics': metrics}, f, indent=2)
+        f.write('\n')
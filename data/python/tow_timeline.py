@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from scofftow import read_tow_cases
+
+# *********************
+# constants
+# *********************
+
+action_columns = {'boot_date': 'boot', 'tow_date': 'tow'}
+
+# *********************
+# functions
+# *********************
+
+def read_action_timeline():
+    """Every boot and tow as its own row, by integer plate key and sorted by date."""
+    cases = read_tow_cases(columns=['plate_key_id'] + list(action_columns))
+
+    has_date = [cases[column].notna().to_numpy() for column in action_columns]
+
+    timeline = pd.concat([cases.loc[has, ['plate_key_id']] for has in has_date], ignore_index=True)
+    timeline['action'] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(action_columns)), [has.sum() for has in has_date]),
+        categories=list(action_columns.values())
+    )
+    timeline['action_date'] = np.concatenate([cases[column].to_numpy()[has] for column, has in zip(action_columns, has_date)])
+
+    order = np.argsort(timeline['action_date'].to_numpy(), kind='stable')
+
+    return timeline.take(order).reset_index(drop=True)
+
+def first_action_after(plates, timeline, date_column='tow_eligible_date'):
+    """For every plate with a date, the first boot or tow on or after that date and the lag in days.
+
+    Done as one sorted merge over all plates rather than a merge of every plate
+    against every action. Plates without a date, or without a later action, get missing values.
+    """
+    has_date = plates[date_column].notna().to_numpy()
+
+    # merge_asof needs both sides sorted by date
+    eligible = plates.loc[has_date, ['plate_key_id', date_column]]
+    eligible['row'] = np.flatnonzero(has_date)
+    eligible = eligible.sort_values(date_column, kind='stable')
+
+    matched = pd.merge_asof(
+        eligible, timeline,
+        left_on=date_column, right_on='action_date',
+        by='plate_key_id', direction='forward', allow_exact_matches=True
+    )
+
+    # back into the order of plates, with the trailing missing value for plates without a date
+    position = np.full(len(plates), -1)
+    position[matched['row'].to_numpy()] = np.arange(len(matched))
+
+    next_action_date = np.append(matched['action_date'].to_numpy(), np.datetime64('NaT'))[position]
+    next_action = pd.Categorical(np.append(matched['action'].astype(object).to_numpy(), None)[position], categories=list(action_columns.values()))
+
+    return pd.DataFrame({
+        'next_action_date': next_action_date,
+        'next_action': next_action,
+        'action_lag_days': (next_action_date - plates[date_column].to_numpy()) / np.timedelta64(1, 'D')
+    }, index=plates.index)
@@ -0,0 +1,43 @@
+import { getDataPath } from "./paths";
+
+let metricsPromise;
+
+/**
+ * Loads the headline numbers written by data/python/generate_scroll_data.py, fetched once per page
+ * @returns {Promise<Object>} The metrics, by name
+ */
+export function loadScrollMetrics() {
+  metricsPromise ??= fetch(getDataPath("scroll_metrics.json"))
+    .then((response) => response.json())
+    .then((artifact) => artifact.metrics);
+  return metricsPromise;
+}
+
+/**
+ * Rounds a number up to a multiple of step, for figures quoted as "nearly"
+ * @param {number} value - The number to round
+ * @param {number} step - The multiple to round to
+ * @returns {string} The rounded number, formatted with thousands separators
+ */
+export function nearly(value, step) {
+  return (Math.ceil(value / step) * step).toLocaleString("en-US");
+}
+
+/**
+ * Rounds a number down to a multiple of step, for figures quoted as "over"
+ * @param {number} value - The number to round
+ * @param {number} step - The multiple to round to
+ * @returns {string} The rounded number, formatted with thousands separators
+ */
+export function over(value, step) {
+  return (Math.floor(value / step) * step).toLocaleString("en-US");
+}
+
+/**
+ * Formats a share as a whole percentage
+ * @param {number} share - A share between 0 and 1
+ * @returns {string} The percentage, e.g. "50%"
+ */
+export function percent(share) {
+  return `${Math.round(share * 100)}%`;
+}